@@ -1,4 +1,11 @@
 # app/api/auth.py
+import hashlib
+import hmac
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Tuple
+
 from flask import (
     Blueprint,
     render_template,
@@ -7,44 +14,238 @@ from flask import (
     session,
     redirect,
     url_for,
+    g,
+    current_app,
 )
-from werkzeug.security import generate_password_hash, check_password_hash
+from passlib.context import CryptContext
+from werkzeug.security import check_password_hash
 
-from app.db import get_connection
+from app.cache import TTLCache
+from app.config import settings
+from app.db import get_connection, named_cursor
 from app.api.salary_utils import format_salary_text
-from app.api.jobs import _format_deadline
+from app.api.jobs import _format_deadline, _encode_page_cursor, _decode_page_cursor
 
 auth_bp = Blueprint("auth", __name__)
 
+_MISSING = object()
+
+# argon2id cho hash mới; bcrypt vẫn verify được
+pwd_ctx = CryptContext(
+    schemes=["argon2", "bcrypt"],
+    deprecated="auto",
+    argon2__memory_cost=65536,
+    argon2__time_cost=3,
+    argon2__parallelism=2,
+)
+
+
+def _is_legacy_hash(password_hash: str) -> bool:
+    """Hash cũ của werkzeug có dạng 'pbkdf2:...' / 'scrypt:...' (không bắt đầu bằng '$')."""
+    return not password_hash.startswith("$")
+
+
+# pool riêng cho hash/verify mật khẩu (argon2/bcrypt tốn 50-250ms CPU)
+_HASH_POOL = ThreadPoolExecutor(
+    max_workers=settings.PASSWORD_HASH_WORKERS or os.cpu_count() or 1,
+    thread_name_prefix="pwd-hash",
+)
+
+
+def _run_in_hash_pool(fn, *args):
+    """
+    Chạy fn trong _HASH_POOL và chờ kết quả.
+    Với gevent (đã monkey-patch) .result() nhường greenlet cho request khác;
+    với sync/gthread thì giới hạn số hash chạy song song theo số CPU.
+    """
+    return _HASH_POOL.submit(fn, *args).result()
+
+
+def _hash_password(password: str) -> str:
+    return _run_in_hash_pool(pwd_ctx.hash, password)
+
+
+def _check_password(password_hash: str, password: str) -> bool:
+    return _run_in_hash_pool(_check_password_sync, password_hash, password)
+
+
+def _check_password_sync(password_hash: str, password: str) -> bool:
+    if _is_legacy_hash(password_hash):
+        return check_password_hash(password_hash, password)
+    try:
+        return pwd_ctx.verify(password, password_hash)
+    except ValueError:
+        return False
+
+
+def _password_needs_rehash(password_hash: str) -> bool:
+    return _is_legacy_hash(password_hash) or pwd_ctx.needs_update(password_hash)
+
+
+# hash giả dùng khi không tìm thấy user (login constant-time).
+# Tính lần đầu cần tới, không chạy argon2 lúc import (worker, script index, ...)
+@lru_cache(maxsize=1)
+def _invalid_hash() -> str:
+    return _hash_password("__invalid__")
+
+# cache kết quả verify mật khẩu: (password_hash, hmac(password)) -> bool
+_verify_cache = TTLCache(settings.VERIFY_PASSWORD_CACHE_SIZE)
+
+
+def _verify_password(password_hash: str, password: str) -> bool:
+    """
+    Verify mật khẩu, có cache (bật bằng USE_VERIFY_PASSWORD_CACHE).
+    Key cache là HMAC-SHA256 của mật khẩu với SECRET_KEY, không giữ plaintext.
+    """
+    if not settings.USE_VERIFY_PASSWORD_CACHE:
+        return _check_password(password_hash, password)
+
+    secret = str(current_app.secret_key or "").encode("utf-8")
+    digest = hmac.new(secret, password.encode("utf-8"), hashlib.sha256).digest()
+    key = (password_hash, digest)
+
+    cached = _verify_cache.get(key)
+    if cached is not None:
+        return cached
+
+    ok = _check_password(password_hash, password)
+    _verify_cache.put(key, ok)
+    return ok
+
 
 # helper
 def get_current_user():
-    """Lấy user hiện tại từ session, trả về dict hoặc None."""
+    """
+    Lấy user hiện tại từ session, trả về dict hoặc None.
+    Kết quả được cache trên flask.g trong suốt 1 request.
+    """
+    cached = g.get("_current_user", _MISSING)
+    if cached is not _MISSING:
+        return cached
+
     user_id = session.get("user_id")
     if not user_id:
+        g._current_user = None
         return None
 
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("EXECUTE get_user(%s)", (user_id,))
+            row = cur.fetchone()
+
+    if not row or not row["is_active"]:
+        row = None
+    g._current_user = row
+    return row
+
+
+def _load_password_hash(user_id):
+    """Chỉ lấy password_hash khi cần verify mật khẩu (đổi mật khẩu)."""
     with get_connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
-                """
-                SELECT
-                    id,
-                    full_name,
-                    email,
-                    phone,
-                    password_hash,
-                    is_active
-                FROM users
-                WHERE id = %(user_id)s
-                """,
+                "SELECT password_hash FROM users WHERE id = %(user_id)s",
                 {"user_id": user_id},
             )
             row = cur.fetchone()
+    return row["password_hash"] if row else None
 
-    if not row or not row["is_active"]:
-        return None
-    return row
+
+def _json_strs(*keys) -> Tuple[str, ...]:
+    """
+    Đọc body JSON và trả về các field dạng str đã strip, theo thứ tự keys.
+    Field thiếu / null / không phải str -> "".
+    """
+    data = request.get_json() or {}
+    return tuple(
+        v.strip() if isinstance(v, str) else "" for v in map(data.get, keys)
+    )
+
+
+def _invalidate_current_user():
+    """Xoá cache user trên flask.g sau khi đổi session / dữ liệu user."""
+    g.pop("_current_user", None)
+
+
+def _fetch_saved_jobs(conn, user_id, limit: int, offset: int, after=None):
+    """
+    Lấy 1 trang job đã bookmark của user.
+    - after: cursor keyset của trang trước -> bỏ OFFSET và window count.
+    Trả về (saved_jobs, total, last_key); total = 0 nếu trang rỗng
+    hoặc đi theo keyset (tổng số lấy từ cursor).
+    """
+    saved_jobs = []
+    total = 0
+    last_key = None
+    params = {"user_id": user_id, "limit": limit}
+    if after:
+        keyset_sql = "AND (j.crawled_at, j.id) < (%(after_crawled_at)s, %(after_id)s)"
+        count_select = "NULL AS total_cnt"
+        offset_sql = ""
+        params["after_crawled_at"] = after["crawled_at"]
+        params["after_id"] = after["id"]
+    else:
+        keyset_sql = ""
+        count_select = "COUNT(*) OVER () AS total_cnt"
+        offset_sql = "OFFSET %(offset)s"
+        params["offset"] = offset
+    # server-side cursor cho danh sách, stream từng row
+    with named_cursor(conn, "bookmarks", itersize=limit) as cur:
+        cur.execute(
+            f"""
+            SELECT
+                j.id AS job_id,
+                j.title,
+                COALESCE(c.name, '') AS company,
+                COALESCE(pl.location_text, '') AS location_text,
+                j.salary_min,
+                j.salary_max,
+                j.salary_currency,
+                j.salary_interval,
+                j.salary_raw_text,
+                j.deadline,
+                j.crawled_at,
+                {count_select}
+            FROM user_job_bookmarks b
+            JOIN jobs j ON j.id = b.job_id
+            LEFT JOIN companies c ON j.company_id = c.id
+            LEFT JOIN LATERAL (
+                SELECT jl.location_text
+                FROM job_locations jl
+                WHERE jl.job_id = j.id
+                ORDER BY jl.is_primary DESC, jl.sort_order, jl.id
+                LIMIT 1
+            ) pl ON TRUE
+            WHERE b.user_id = %(user_id)s
+            {keyset_sql}
+            ORDER BY j.crawled_at DESC NULLS LAST, j.id DESC
+            LIMIT %(limit)s {offset_sql}
+            """,
+            params,
+        )
+        for r in cur:
+            total = r["total_cnt"] or 0
+            last_key = (r["crawled_at"], r["job_id"])
+            loc = r["location_text"] or ""
+            salary_text = format_salary_text(
+                r.get("salary_min"),
+                r.get("salary_max"),
+                r.get("salary_currency"),
+                r.get("salary_interval"),
+                r.get("salary_raw_text"),
+            )
+            saved_jobs.append(
+                {
+                    "job_id": r["job_id"],
+                    "title": r["title"],
+                    "company": r["company"],
+                    "city": loc,
+                    "district": None,
+                    "salary_text": salary_text,
+                    "deadline_text": _format_deadline(r.get("deadline")),
+                }
+            )
+    return saved_jobs, total, last_key
 
 
 #  HTML PAGES 
@@ -97,83 +298,62 @@ def profile_section(section: str):
         return redirect(url_for("auth.profile_section", section="bookmarks"))
 
     saved_jobs = []
+    bookmark_next_cursor = None
+    last_key = None
     if section == "bookmarks":
+        after = (
+            _decode_page_cursor(request.args.get("after"))
+            if bookmark_page > 1
+            else None
+        )
         with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    """
-                    SELECT COUNT(*) AS cnt
-                    FROM user_job_bookmarks
-                    WHERE user_id = %(user_id)s
-                    """,
-                    {"user_id": user["id"]},
-                )
-                row_cnt = cur.fetchone()
-                bookmark_total = row_cnt["cnt"] if row_cnt else 0
+            offset = (bookmark_page - 1) * bookmark_per_page
+            saved_jobs, bookmark_total, last_key = _fetch_saved_jobs(
+                conn, user["id"], bookmark_per_page, offset, after=after
+            )
+            if after and saved_jobs:
+                # keyset không đọc window count -> dùng tổng số trong cursor
+                bookmark_total = after["total"]
+
+            if not saved_jobs and bookmark_page > 1:
+                # page vượt quá số trang -> đếm lại rồi lấy trang cuối
+                with conn.cursor() as cur:
+                    cur.execute(
+                        """
+                        SELECT COUNT(*) AS cnt
+                        FROM user_job_bookmarks
+                        WHERE user_id = %(user_id)s
+                        """,
+                        {"user_id": user["id"]},
+                    )
+                    row_cnt = cur.fetchone()
+                    bookmark_total = row_cnt["cnt"] if row_cnt else 0
                 if bookmark_total:
-                    bookmark_total_pages = max(
+                    bookmark_page = max(
                         (bookmark_total + bookmark_per_page - 1) // bookmark_per_page, 1
                     )
-                    bookmark_page = min(bookmark_page, bookmark_total_pages)
-                else:
-                    bookmark_page = 1
-                offset = (bookmark_page - 1) * bookmark_per_page
-
-                cur.execute(
-                    """
-                    SELECT
-                        j.id AS job_id,
-                        j.title,
-                        COALESCE(c.name, '') AS company,
-                        COALESCE(
-                            (
-                                SELECT jl.location_text
-                                FROM job_locations jl
-                                WHERE jl.job_id = j.id
-                                ORDER BY jl.is_primary DESC, jl.sort_order, jl.id
-                                LIMIT 1
-                            ),
-                            ''
-                        ) AS location_text,
-                        j.salary_min,
-                        j.salary_max,
-                        j.salary_currency,
-                        j.salary_interval,
-                        j.salary_raw_text,
-                        j.deadline
-                    FROM user_job_bookmarks b
-                    JOIN jobs j ON j.id = b.job_id
-                    LEFT JOIN companies c ON j.company_id = c.id
-                    WHERE b.user_id = %(user_id)s
-                    ORDER BY j.crawled_at DESC NULLS LAST, j.id DESC
-                    LIMIT %(limit)s OFFSET %(offset)s
-                    """,
-                    {
-                        "user_id": user["id"],
-                        "limit": bookmark_per_page,
-                        "offset": offset,
-                    },
-                )
-                rows = cur.fetchall()
+                    offset = (bookmark_page - 1) * bookmark_per_page
+                    saved_jobs, bookmark_total, last_key = _fetch_saved_jobs(
+                        conn, user["id"], bookmark_per_page, offset
+                    )
 
-        for r in rows:
-            loc = r["location_text"] or ""
-            salary_text = format_salary_text(
-                r.get("salary_min"),
-                r.get("salary_max"),
-                r.get("salary_currency"),
-                r.get("salary_interval"),
-                r.get("salary_raw_text"),
+        if bookmark_total:
+            bookmark_total_pages = max(
+                (bookmark_total + bookmark_per_page - 1) // bookmark_per_page, 1
             )
-            saved_jobs.append(
+        else:
+            bookmark_page = 1
+
+        if (
+            last_key
+            and len(saved_jobs) == bookmark_per_page
+            and bookmark_page < bookmark_total_pages
+        ):
+            bookmark_next_cursor = _encode_page_cursor(
                 {
-                    "job_id": r["job_id"],
-                    "title": r["title"],
-                    "company": r["company"],
-                    "city": loc,
-                    "district": None,
-                    "salary_text": salary_text,
-                    "deadline_text": _format_deadline(r.get("deadline")),
+                    "crawled_at": last_key[0].isoformat(),
+                    "id": last_key[1],
+                    "total": bookmark_total,
                 }
             )
 
@@ -187,6 +367,7 @@ def profile_section(section: str):
         bookmark_page=bookmark_page,
         bookmark_total_pages=bookmark_total_pages,
         bookmark_total=bookmark_total,
+        bookmark_next_cursor=bookmark_next_cursor,
     )
 
 
@@ -194,30 +375,24 @@ def profile_section(section: str):
 
 @auth_bp.route("/api/register", methods=["POST"])
 def api_register():
-    data = request.get_json() or {}
-    full_name = (data.get("full_name") or "").strip()
-    email = (data.get("email") or "").strip().lower()
-    phone = (data.get("phone") or "").strip()
-    password = (data.get("password") or "").strip()
+    full_name, email, phone, password = _json_strs(
+        "full_name", "email", "phone", "password"
+    )
+    email = email.lower()
 
     if not full_name or not email or not password:
         return jsonify({"detail": "Thiếu thông tin bắt buộc."}), 400
 
-    password_hash = generate_password_hash(password)
+    password_hash = _hash_password(password)
 
     with get_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute(
-                "SELECT id FROM users WHERE email = %(email)s",
-                {"email": email},
-            )
-            if cur.fetchone():
-                return jsonify({"detail": "Email đã được sử dụng."}), 400
-
+            # email UNIQUE -> trùng thì không có row trả về
             cur.execute(
                 """
                 INSERT INTO users (full_name, email, phone, password_hash, is_active)
                 VALUES (%(full_name)s, %(email)s, %(phone)s, %(password_hash)s, TRUE)
+                ON CONFLICT (email) DO NOTHING
                 RETURNING id
                 """,
                 {
@@ -228,47 +403,62 @@ def api_register():
                 },
             )
             row = cur.fetchone()
+            if not row:
+                return jsonify({"detail": "Email đã được sử dụng."}), 400
             user_id = row["id"]
         conn.commit()
 
     session["user_id"] = user_id
+    _invalidate_current_user()
     return jsonify({"ok": True})
 
 
 @auth_bp.route("/api/login", methods=["POST"])
 def api_login():
-    data = request.get_json() or {}
-    email = (data.get("email") or "").strip().lower()
-    password = (data.get("password") or "").strip()
+    email, password = _json_strs("email", "password")
+    email = email.lower()
 
     if not email or not password:
         return jsonify({"detail": "Thiếu email hoặc mật khẩu."}), 400
 
     with get_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT id, full_name, email, phone, password_hash, is_active
-                FROM users
-                WHERE email = %(email)s
-                """,
-                {"email": email},
-            )
+            cur.execute("EXECUTE get_user_by_email(%s)", (email,))
             user = cur.fetchone()
 
-    if not user or not user["is_active"]:
-        return jsonify({"detail": "Tài khoản không tồn tại hoặc đã bị khóa."}), 401
+    # luôn verify 1 hash (hash giả nếu không có user) để thời gian phản hồi
+    # không lộ việc email có tồn tại hay không
+    is_valid_user = bool(user and user["is_active"])
+    password_hash = user["password_hash"] if is_valid_user else _invalid_hash()
+    password_ok = _verify_password(password_hash, password)
 
-    if not check_password_hash(user["password_hash"], password):
+    if not is_valid_user or not password_ok:
         return jsonify({"detail": "Email hoặc mật khẩu không đúng."}), 401
 
+    # nâng cấp hash cũ (werkzeug / tham số yếu hơn) sang argon2id
+    if _password_needs_rehash(password_hash):
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE users
+                    SET password_hash = %(password_hash)s,
+                        updated_at = NOW()
+                    WHERE id = %(user_id)s
+                    """,
+                    {"password_hash": _hash_password(password), "user_id": user["id"]},
+                )
+            conn.commit()
+
     session["user_id"] = user["id"]
+    _invalidate_current_user()
     return jsonify({"ok": True})
 
 
 @auth_bp.route("/api/logout", methods=["POST"])
 def api_logout():
     session.clear()
+    _invalidate_current_user()
     return jsonify({"ok": True})
 
 
@@ -295,9 +485,7 @@ def api_me_update():
     if not user:
         return jsonify({"detail": "Chưa đăng nhập."}), 401
 
-    data = request.get_json() or {}
-    full_name = (data.get("full_name") or "").strip()
-    phone = (data.get("phone") or "").strip()
+    full_name, phone = _json_strs("full_name", "phone")
 
     if not full_name:
         return jsonify({"detail": "Họ tên không được để trống."}), 400
@@ -315,6 +503,7 @@ def api_me_update():
                 {"full_name": full_name, "phone": phone, "user_id": user["id"]},
             )
         conn.commit()
+    _invalidate_current_user()
 
     return jsonify({"ok": True})
 
@@ -325,17 +514,16 @@ def api_change_password():
     if not user:
         return jsonify({"detail": "Chưa đăng nhập."}), 401
 
-    data = request.get_json() or {}
-    old_password = (data.get("old_password") or "").strip()
-    new_password = (data.get("new_password") or "").strip()
+    old_password, new_password = _json_strs("old_password", "new_password")
 
     if not old_password or not new_password:
         return jsonify({"detail": "Thiếu mật khẩu cũ hoặc mới."}), 400
 
-    if not check_password_hash(user["password_hash"], old_password):
+    password_hash = _load_password_hash(user["id"])
+    if not password_hash or not _verify_password(password_hash, old_password):
         return jsonify({"detail": "Mật khẩu hiện tại không đúng."}), 400
 
-    new_hash = generate_password_hash(new_password)
+    new_hash = _hash_password(new_password)
 
     with get_connection() as conn:
         with conn.cursor() as cur:
@@ -349,6 +537,7 @@ def api_change_password():
                 {"password_hash": new_hash, "user_id": user["id"]},
             )
         conn.commit()
+    _invalidate_current_user()
 
     return jsonify({"ok": True})
 
@@ -370,39 +559,12 @@ def api_toggle_star():
     except (TypeError, ValueError):
         return jsonify({"detail": "job_id không hợp lệ."}), 400
 
-    starred = False
-
     with get_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT 1
-                FROM user_job_bookmarks
-                WHERE user_id = %(user_id)s AND job_id = %(job_id)s
-                """,
-                {"user_id": user["id"], "job_id": job_id},
-            )
-            exists = cur.fetchone() is not None
-
-            if exists:
-                cur.execute(
-                    """
-                    DELETE FROM user_job_bookmarks
-                    WHERE user_id = %(user_id)s AND job_id = %(job_id)s
-                    """,
-                    {"user_id": user["id"], "job_id": job_id},
-                )
-                starred = False
-            else:
-                cur.execute(
-                    """
-                    INSERT INTO user_job_bookmarks (user_id, job_id)
-                    VALUES (%(user_id)s, %(job_id)s)
-                    ON CONFLICT (user_id, job_id) DO NOTHING
-                    """,
-                    {"user_id": user["id"], "job_id": job_id},
-                )
-                starred = True
+            # 1 round-trip: xoá nếu đã có, ngược lại insert (xem app/db.py)
+            cur.execute("EXECUTE toggle_bookmark(%s, %s)", (user["id"], job_id))
+            row = cur.fetchone()
+            starred = bool(row and row["inserted"])
         conn.commit()
 
     return jsonify({"job_id": job_id, "starred": starred})
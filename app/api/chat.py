@@ -2,12 +2,34 @@
 
 from __future__ import annotations
 
-from flask import Blueprint, jsonify, request
+import orjson
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
 
-from app.api.rag.chat_logic import chat_with_rag
+from app.api.rag.chat_logic import chat_with_rag, chat_with_rag_stream
 
 chat_bp = Blueprint("chat", __name__)
 
+# phần đầu cố định của mỗi frame SSE, dựng sẵn 1 lần
+_SSE_PREFIXES = {
+    kind: f"event: {kind}\ndata: ".encode("ascii")
+    for kind in ("context", "delta", "done")
+}
+_SSE_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_NAIVE_UTC
+
+
+def _read_chat_request():
+    """Đọc body chung cho /api/chat và /api/chat/stream."""
+    data = request.get_json(silent=True) or {}
+    message = (data.get("message") or "").strip()
+    history = data.get("history") or []
+    current_job_id = data.get("current_job_id")
+
+    try:
+        current_job_id = int(current_job_id) if current_job_id is not None else None
+    except (TypeError, ValueError):
+        current_job_id = None
+    return message, history, current_job_id
+
 
 @chat_bp.route("/api/chat", methods=["POST"])
 def api_chat():
@@ -24,15 +46,7 @@ def api_chat():
       "current_job_id": 123  # optional, nếu user đang ở trang chi tiết job
     }
     """
-    data = request.get_json(silent=True) or {}
-    message = (data.get("message") or "").strip()
-    history = data.get("history") or []
-    current_job_id = data.get("current_job_id")
-
-    try:
-        current_job_id = int(current_job_id) if current_job_id is not None else None
-    except (TypeError, ValueError):
-        current_job_id = None
+    message, history, current_job_id = _read_chat_request()
 
     result = chat_with_rag(
         user_message=message,
@@ -42,3 +56,34 @@ def api_chat():
     )
 
     return jsonify(result), 200
+
+
+@chat_bp.route("/api/chat/stream", methods=["POST"])
+def api_chat_stream():
+    """
+    Như /api/chat nhưng trả về Server-Sent Events:
+    - event "context": {"context_jobs": [...]} ngay sau bước retrieve
+    - event "delta": {"text": "...", "lines": [...]} từng đoạn text thô
+      + HTML các dòng vừa hoàn chỉnh
+    - event "done": {"answer": "<HTML>", "context_jobs": [...], ...}
+    """
+    message, history, current_job_id = _read_chat_request()
+    default = current_app.json.default
+
+    # frame dạng bytes: orjson.dumps trả bytes sẵn, không qua str rồi encode lại
+    def _events():
+        for event in chat_with_rag_stream(
+            message,
+            history,
+            current_job_id=current_job_id,
+            top_k=5,
+        ):
+            kind = event.pop("type", "delta")
+            prefix = _SSE_PREFIXES.get(kind) or f"event: {kind}\ndata: ".encode("utf-8")
+            yield prefix + orjson.dumps(event, default=default, option=_SSE_OPTIONS) + b"\n\n"
+
+    return Response(
+        stream_with_context(_events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
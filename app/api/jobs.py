@@ -1,8 +1,21 @@
 # app/api/jobs.py
-from datetime import datetime, timezone
-
-from flask import Blueprint, render_template, request, session, abort
-from app.db import get_connection
+import base64
+import hashlib
+import json
+from datetime import date, datetime, timezone
+from functools import lru_cache
+
+from flask import (
+    Blueprint,
+    render_template,
+    request,
+    session,
+    abort,
+    g,
+    has_request_context,
+    make_response,
+)
+from app.db import get_connection, named_cursor
 from app.api.salary_utils import format_salary_text
 
 jobs_bp = Blueprint("jobs", __name__)
@@ -36,6 +49,10 @@ SECTION_ORDER = [
     "thong_tin_khac",
 ]
 
+# section_type -> thứ tự hiển thị; type lạ xếp sau cùng
+_SECTION_RANK = {k: i for i, k in enumerate(SECTION_ORDER)}
+_SECTION_RANK_UNKNOWN = len(SECTION_ORDER)
+
 
 def _build_where_and_params(q: str):
     params = {}
@@ -47,14 +64,77 @@ def _build_where_and_params(q: str):
     return where_sql, params
 
 
-def _format_deadline(deadline):
-    if not deadline:
+# Nhóm hạn nộp: 0 = còn hạn, 1 = không có hạn, 2 = đã hết hạn
+_DEADLINE_BUCKET_SQL = """
+    CASE
+        WHEN j.deadline IS NOT NULL AND j.deadline >= NOW() THEN 0
+        WHEN j.deadline IS NULL THEN 1
+        ELSE 2
+    END
+"""
+# điều kiện trên deadline của từng nhóm (cùng thứ tự với _DEADLINE_BUCKET_SQL)
+_DEADLINE_BUCKET_PREDICATES = (
+    "j.deadline >= NOW()",
+    "j.deadline IS NULL",
+    "j.deadline < NOW()",
+)
+
+
+def _encode_page_cursor(data: dict) -> str:
+    """Mã hoá cursor keyset (vị trí row cuối + tổng số) thành token cho URL."""
+    raw = json.dumps(data, separators=(",", ":"), default=str).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_page_cursor(token):
+    """
+    Giải mã token của _encode_page_cursor.
+    Trả về dict {crawled_at, id, total, ...} hoặc None nếu token hỏng.
+    """
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        data = json.loads(raw)
+        data["crawled_at"] = datetime.fromisoformat(data["crawled_at"])
+        data["id"] = int(data["id"])
+        data["total"] = int(data["total"])
+    except (ValueError, TypeError, KeyError):
         return None
+    return data
+
+
+def _starred_sql(user_id):
+    """
+    Trả về (select_sql, join_sql) cho cột starred.
+    Khách chưa đăng nhập -> bỏ hẳn JOIN user_job_bookmarks.
+    """
+    if user_id is None:
+        return "FALSE AS starred", ""
+    return (
+        "CASE WHEN ub.user_id IS NULL THEN FALSE ELSE TRUE END AS starred",
+        """LEFT JOIN user_job_bookmarks ub
+                    ON ub.job_id = j.id AND ub.user_id = %(user_id)s""",
+    )
+
+
+def _today_utc() -> date:
+    """Ngày hiện tại (UTC), tính 1 lần cho mỗi request."""
+    if not has_request_context():
+        return datetime.now(timezone.utc).date()
+    today = g.get("_today_utc")
+    if today is None:
+        today = datetime.now(timezone.utc).date()
+        g._today_utc = today
+    return today
+
+
+@lru_cache(maxsize=1024)
+def _format_deadline_for(deadline, today: date):
     if deadline.tzinfo is None:
         deadline = deadline.replace(tzinfo=timezone.utc)
 
-    now = datetime.now(timezone.utc)
-    days = (deadline.date() - now.date()).days
+    days = (deadline.date() - today).days
     date_str = deadline.strftime("%d/%m/%Y")
 
     if days >= 0:
@@ -63,6 +143,68 @@ def _format_deadline(deadline):
         return f"Hạn nộp hồ sơ: {date_str} - hết hạn"
 
 
+def _format_deadline(deadline):
+    if not deadline:
+        return None
+    return _format_deadline_for(deadline, _today_utc())
+
+
+def _anon_index_etag() -> str:
+    """
+    ETag cho trang chủ khi chưa login: phụ thuộc query string,
+    job mới nhất (max crawled_at) và giờ hiện tại (job còn hạn/hết hạn đổi theo NOW()).
+    """
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT extract(epoch FROM max(crawled_at)) AS max_ts FROM jobs")
+            row = cur.fetchone()
+    max_ts = row["max_ts"] if row else None
+    hour = datetime.now(timezone.utc).strftime("%Y%m%d%H")
+    raw = f"{request.query_string.decode('latin-1')}|{max_ts}|{hour}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def _index_list_select(bucket_sql: str, count_select: str, starred_select: str, starred_join: str) -> str:
+    """SELECT ... FROM ... (chưa có WHERE / ORDER BY) cho danh sách job ở trang chủ."""
+    return f"""
+            SELECT
+                j.id AS job_id,
+                j.title,
+                COALESCE(c.name, '') AS company,
+                COALESCE(pl.location_text, '') AS location_text,
+                j.salary_min,
+                j.salary_max,
+                j.salary_currency,
+                j.salary_interval,
+                j.salary_raw_text,
+                j.deadline,
+                j.crawled_at,
+                {bucket_sql} AS sort_bucket,
+                {starred_select},
+                {count_select}
+            FROM jobs j
+            LEFT JOIN companies c ON j.company_id = c.id
+            LEFT JOIN LATERAL (
+                SELECT jl.location_text
+                FROM job_locations jl
+                WHERE jl.job_id = j.id
+                ORDER BY jl.is_primary DESC, jl.sort_order, jl.id
+                LIMIT 1
+            ) pl ON TRUE
+            {starred_join}
+    """
+
+
+def _set_anon_cache_headers(resp, etag: str) -> None:
+    """
+    no-cache: trình duyệt luôn hỏi lại server (304 nếu ETag khớp), không dùng bản
+    khách đã cache sau khi vừa login (starred sai). Vary: Cookie tách bản theo session.
+    """
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "private, no-cache"
+    resp.vary.add("Cookie")
+
+
 @jobs_bp.route("/")
 def index():
     """
@@ -71,127 +213,160 @@ def index():
     - Hiển thị danh sách job (DB thật).
     - Ưu tiên công việc còn hạn lên đầu.
     - Hiển thị: Tổng công việc: X - Y công việc còn hạn.
+    - Link "Sau" mang cursor keyset (?after=...), nhảy trang vẫn dùng OFFSET.
     """
+    user_id = session.get("user_id")
+    # chỉ cache cho khách: cột starred khác nhau theo từng user
+    etag = _anon_index_etag() if user_id is None else None
+    if etag and request.if_none_match.contains(etag):
+        resp = make_response("", 304)
+        _set_anon_cache_headers(resp, etag)
+        return resp
+
     q = (request.args.get("q") or "").strip()
     page = int(request.args.get("page") or "1")
     page = max(page, 1)
     per_page = 9
     offset = (page - 1) * per_page
+    after = _decode_page_cursor(request.args.get("after")) if page > 1 else None
 
-    user_id = session.get("user_id")
     where_sql, base_params = _build_where_and_params(q)
-
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            # Tổng job (theo filter q)
-            cur.execute(
-                f"""
-                SELECT COUNT(*) AS cnt
-                FROM jobs j
-                LEFT JOIN companies c ON j.company_id = c.id
-                {where_sql}
-                """,
-                base_params,
-            )
-            row = cur.fetchone()
-            total = row["cnt"] if row else 0
-
-            # Tổng job còn hạn: deadline >= NOW()
-            if where_sql:
-                active_where = where_sql + " AND (j.deadline IS NOT NULL AND j.deadline >= NOW())"
-            else:
-                active_where = "WHERE j.deadline IS NOT NULL AND j.deadline >= NOW()"
-
-            cur.execute(
-                f"""
-                SELECT COUNT(*) AS cnt
-                FROM jobs j
-                LEFT JOIN companies c ON j.company_id = c.id
-                {active_where}
-                """,
-                base_params,
-            )
-            row2 = cur.fetchone()
-            active_total = row2["cnt"] if row2 else 0
-
-            # Danh sách job (ưu tiên job còn hạn)
-            params = dict(base_params)
-            params.update(
-                {
-                    "limit": per_page,
-                    "offset": offset,
-                    "user_id": user_id,
-                }
+    starred_select, starred_join = _starred_sql(user_id)
+
+    params = dict(base_params)
+    params["limit"] = per_page
+    if user_id is not None:
+        params["user_id"] = user_id
+
+    if after:
+        # keyset: bỏ OFFSET, tổng số lấy từ cursor của trang trước.
+        # Mỗi nhóm hạn nộp từ nhóm của cursor trở đi là 1 nhánh riêng, lọc theo
+        # deadline và đọc theo idx_jobs_crawled_at_id (dừng sau LIMIT row)
+        # -> sort cuối chỉ trên tối đa 3 * per_page row, không phụ thuộc độ sâu trang
+        after_bucket = min(
+            max(int(after.get("bucket") or 0), 0), len(_DEADLINE_BUCKET_PREDICATES) - 1
+        )
+        branches = []
+        for bucket in range(after_bucket, len(_DEADLINE_BUCKET_PREDICATES)):
+            preds = [_DEADLINE_BUCKET_PREDICATES[bucket]]
+            if bucket == after_bucket:
+                preds.append("(j.crawled_at, j.id) < (%(after_crawled_at)s, %(after_id)s)")
+            branch_where = (where_sql + " AND " if where_sql else "WHERE ") + " AND ".join(preds)
+            branches.append(
+                "("
+                + _index_list_select(
+                    str(bucket),
+                    "NULL AS total_cnt, NULL AS active_cnt",
+                    starred_select,
+                    starred_join,
+                )
+                + f"""
+                {branch_where}
+                ORDER BY j.crawled_at DESC NULLS LAST, j.id DESC
+                LIMIT %(limit)s)"""
             )
-
-            cur.execute(
-                f"""
-                SELECT
-                    j.id AS job_id,
-                    j.title,
-                    COALESCE(c.name, '') AS company,
-                    COALESCE(
-                        (
-                            SELECT jl.location_text
-                            FROM job_locations jl
-                            WHERE jl.job_id = j.id
-                            ORDER BY jl.is_primary DESC, jl.sort_order, jl.id
-                            LIMIT 1
-                        ),
-                        ''
-                    ) AS location_text,
-                    j.salary_min,
-                    j.salary_max,
-                    j.salary_currency,
-                    j.salary_interval,
-                    j.salary_raw_text,
-                    j.deadline,
-                    CASE WHEN ub.user_id IS NULL THEN FALSE ELSE TRUE END AS starred
-                FROM jobs j
-                LEFT JOIN companies c ON j.company_id = c.id
-                LEFT JOIN user_job_bookmarks ub
-                    ON ub.job_id = j.id AND ub.user_id = %(user_id)s
+        list_sql = (
+            " UNION ALL ".join(branches)
+            + """
+                ORDER BY sort_bucket, crawled_at DESC NULLS LAST, job_id DESC
+                LIMIT %(limit)s
+            """
+        )
+        params["after_crawled_at"] = after["crawled_at"]
+        params["after_id"] = after["id"]
+    else:
+        # window chạy sau WHERE nên đếm đúng theo filter q
+        count_select = """
+            COUNT(*) OVER () AS total_cnt,
+            COUNT(*) FILTER (
+                WHERE j.deadline IS NOT NULL AND j.deadline >= NOW()
+            ) OVER () AS active_cnt
+        """
+        list_sql = _index_list_select(
+            _DEADLINE_BUCKET_SQL, count_select, starred_select, starred_join
+        ) + f"""
                 {where_sql}
                 ORDER BY
-                    CASE
-                        WHEN j.deadline IS NOT NULL AND j.deadline >= NOW() THEN 0  -- còn hạn
-                        WHEN j.deadline IS NULL THEN 1                               -- không có hạn
-                        ELSE 2                                                       -- đã hết hạn
-                    END,
+                    sort_bucket,  -- còn hạn, không có hạn, đã hết hạn
                     j.crawled_at DESC NULLS LAST,
                     j.id DESC
                 LIMIT %(limit)s OFFSET %(offset)s
-                """,
-                params,
-            )
-            rows = cur.fetchall()
+        """
+        params["offset"] = offset
+
+    total = after["total"] if after else None
+    active_total = int(after.get("active") or 0) if after else 0
+    jobs = []
+    last_key = None
 
+    with get_connection() as conn:
+        # server-side cursor: stream từng row thay vì fetchall()
+        with named_cursor(conn, "jobs_index", itersize=per_page) as cur:
+            # Danh sách job (ưu tiên job còn hạn)
+            cur.execute(list_sql, params)
+            for r in cur:
+                if total is None:
+                    total = r["total_cnt"]
+                    active_total = r["active_cnt"]
+                last_key = (r["sort_bucket"], r["crawled_at"], r["job_id"])
+                loc = r["location_text"] or ""
+                salary_text = format_salary_text(
+                    r.get("salary_min"),
+                    r.get("salary_max"),
+                    r.get("salary_currency"),
+                    r.get("salary_interval"),
+                    r.get("salary_raw_text"),
+                )
+                jobs.append(
+                    {
+                        "job_id": r["job_id"],
+                        "title": r["title"],
+                        "company": r["company"] or "",
+                        "city": loc,
+                        "district": None,
+                        "salary_text": salary_text,
+                        "starred": bool(r["starred"]),
+                        "deadline_text": _format_deadline(r["deadline"]),
+                    }
+                )
+
+        if total is None and offset:
+            # page vượt quá số trang -> không có row để đọc window count
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"""
+                    SELECT
+                        COUNT(*) AS total_cnt,
+                        COUNT(*) FILTER (
+                            WHERE j.deadline IS NOT NULL AND j.deadline >= NOW()
+                        ) AS active_cnt
+                    FROM jobs j
+                    LEFT JOIN companies c ON j.company_id = c.id
+                    {where_sql}
+                    """,
+                    base_params,
+                )
+                row = cur.fetchone()
+                if row:
+                    total = row["total_cnt"]
+                    active_total = row["active_cnt"]
+
+    total = total or 0
     total_pages = max((total + per_page - 1) // per_page, 1) if total else 1
 
-    jobs = []
-    for r in rows:
-        loc = r["location_text"] or ""
-        salary_text = format_salary_text(
-            r.get("salary_min"),
-            r.get("salary_max"),
-            r.get("salary_currency"),
-            r.get("salary_interval"),
-            r.get("salary_raw_text"),
-        )
-        jobs.append(
+    next_cursor = None
+    if last_key and len(jobs) == per_page and page < total_pages:
+        next_cursor = _encode_page_cursor(
             {
-                "job_id": r["job_id"],
-                "title": r["title"],
-                "company": r["company"] or "",
-                "city": loc,
-                "district": None,
-                "salary_text": salary_text,
-                "starred": bool(r["starred"]),
-                "deadline_text": _format_deadline(r["deadline"]),
+                "bucket": last_key[0],
+                "crawled_at": last_key[1].isoformat(),
+                "id": last_key[2],
+                "total": total,
+                "active": active_total,
             }
         )
 
-    return render_template(
+    html = render_template(
         "index.html",
         title="Trang chủ",
         q=q,
@@ -200,25 +375,21 @@ def index():
         total=total,
         active_total=active_total,
         total_pages=total_pages,
+        next_cursor=next_cursor,
     )
+    if etag is None:
+        return html
 
-def _fetch_job_sections(cur, job_id: int):
+    resp = make_response(html)
+    _set_anon_cache_headers(resp, etag)
+    return resp
+
+def _build_job_sections(rows):
     """
-    Lấy các section từ job_sections và format thành list
+    Format các row section (section_type, text_content, html_content) thành list
     [ {key,label,html,text}, ... ]
     Chỉ trả các section có nội dung.
     """
-    cur.execute(
-        """
-        SELECT section_type, text_content, html_content, id
-        FROM job_sections
-        WHERE job_id = %(job_id)s
-        ORDER BY id
-        """,
-        {"job_id": job_id},
-    )
-    rows = cur.fetchall()
-
     by_type = {}
     for row in rows:
         stype = row["section_type"]
@@ -235,28 +406,25 @@ def _fetch_job_sections(cur, job_id: int):
             "text": text,
         }
 
-    # Sắp xếp theo SECTION_ORDER, sau đó các type lạ
-    result = []
-    for st in SECTION_ORDER:
-        s = by_type.get(st)
-        if s:
-            result.append(s)
-
-    for st, s in by_type.items():
-        if st not in SECTION_ORDER:
-            result.append(s)
-
-    return result
+    # Sắp xếp theo SECTION_ORDER, sau đó các type lạ (sort ổn định)
+    return sorted(
+        by_type.values(),
+        key=lambda s: _SECTION_RANK.get(s["key"], _SECTION_RANK_UNKNOWN),
+    )
 
 
 @jobs_bp.route("/jobs/<int:job_id>")
 def job_detail(job_id: int):
     user_id = session.get("user_id")
+    starred_select, starred_join = _starred_sql(user_id)
+    params = {"job_id": job_id}
+    if user_id is not None:
+        params["user_id"] = user_id
 
     with get_connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
-                """
+                f"""
                 SELECT
                     j.id AS job_id,
                     j.title,
@@ -295,21 +463,39 @@ def job_detail(job_id: int):
                         ''
                     ) AS location_text,
 
-                    CASE WHEN ub.user_id IS NULL THEN FALSE ELSE TRUE END AS starred
+                    {starred_select},
+
+                    js.sections
                 FROM jobs j
                 LEFT JOIN companies c ON j.company_id = c.id
-                LEFT JOIN user_job_bookmarks ub
-                    ON ub.job_id = j.id AND ub.user_id = %(user_id)s
+                {starred_join}
+                -- gom sections vào cùng 1 round-trip
+                LEFT JOIN LATERAL (
+                    SELECT COALESCE(
+                        json_agg(
+                            json_build_object(
+                                'section_type', s.section_type,
+                                'html_content', s.html_content,
+                                'text_content', s.text_content
+                            )
+                            ORDER BY s.id
+                        ) FILTER (
+                            WHERE s.html_content IS NOT NULL OR s.text_content IS NOT NULL
+                        ),
+                        '[]'::json
+                    ) AS sections
+                    FROM job_sections s
+                    WHERE s.job_id = j.id
+                ) js ON TRUE
                 WHERE j.id = %(job_id)s
                 """,
-                {"job_id": job_id, "user_id": user_id},
+                params,
             )
             job_row = cur.fetchone()
             if not job_row:
                 abort(404)
 
-            # Lấy sections
-            detail_sections = _fetch_job_sections(cur, job_id)
+    detail_sections = _build_job_sections(job_row.get("sections") or [])
 
     # thông tin công ty 
     company_info = {
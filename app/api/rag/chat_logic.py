@@ -2,16 +2,40 @@
 
 from __future__ import annotations
 
-import html
-import json
+import datetime
+import hashlib
 import logging
 import re
-from typing import Any, Dict, List, Optional
+import sqlite3
+import string
+import threading
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
 
 import google.generativeai as genai
+import numpy as np
+import orjson
 
+from app.cache import TTLCache
 from app.config import settings
-from app.api.rag.retriever import retrieve_jobs
+from app.api.rag.retriever import (
+    embed_query,
+    embed_retrieval_query,
+    fetch_pinned_docs,
+    get_query_embedding_model,
+    retrieval_filters_text,
+    retrieve_jobs,
+)
+from app.api.rag.gemini_client import configure_gemini
+from app.api.rag.job_render import (
+    _CONTEXT_RENDER_VERSION,
+    _EMPTY_DICT,
+    render_job_fields,
+)
 from app.api.rag.query_parser import parse_user_query
 
 logger = logging.getLogger(__name__)
@@ -31,23 +55,15 @@ NGUYÊN TẮC CHUNG:
 - Không cần giải thích về hệ thống RAG hay cơ sở dữ liệu, chỉ trả lời như một HR đang tư vấn ứng viên.
 """.strip()
 
-UNIFIED_PROMPT = """
-{system_prompt}
+# Phần cố định của prompt (system + cách trả lời theo intent), đặt đầu prompt
+# để Gemini cache được prefix (xem _get_unified_model)
+UNIFIED_STATIC_PREFIX = f"""
+{SYSTEM_PROMPT}
 
-Dưới đây là thông tin đã được hệ thống truy xuất từ cơ sở dữ liệu việc làm (context).
+Mỗi lượt bạn sẽ nhận INTENT, FILTERS và CONTEXT là thông tin đã được hệ thống
+truy xuất từ cơ sở dữ liệu việc làm, kèm câu hỏi của người dùng.
 Bạn CHỈ ĐƯỢC sử dụng thông tin trong context để trả lời.
 
-INTENT: {intent}
-FILTERS (JSON): {filters_json}
-
-CONTEXT (các job, mỗi job có id, tiêu đề, công ty, lương, địa điểm, mô tả, yêu cầu, quyền lợi,...):
-----------------
-{context}
-----------------
-
-Câu hỏi của người dùng:
-"{question}"
-
 CÁCH TRẢ LỜI THEO INTENT:
 
 1) Nếu INTENT = "ask_detail":
@@ -88,78 +104,167 @@ NGUYÊN TẮC BẮT BUỘC:
 - Trả lời bằng tiếng Việt, giọng thân thiện, tự nhiên.
 """.strip()
 
-_unified_model: Optional[genai.GenerativeModel] = None
-
-
-# format lương
-def _format_salary_block(meta: Dict[str, Any]) -> str:
-    salary = meta.get("salary") or {}
-    raw_text = salary.get("raw_text")
-    if raw_text:
-        return raw_text
-
-    salary_min = salary.get("min")
-    salary_max = salary.get("max")
-    currency = salary.get("currency") or "VND"
-    interval = salary.get("interval") or "MONTH"
-
-    interval_vi = {
-        "MONTH": "/tháng",
-        "YEAR": "/năm",
-        "HOUR": "/giờ",
-    }.get(interval, "")
-
-    if salary_min is None and salary_max is None:
-        return "Thoả thuận"
-
-    if salary_min is not None and salary_max is not None:
-        return f"Từ {salary_min:,.0f} đến {salary_max:,.0f} {currency} {interval_vi}"
-
-    if salary_min is not None:
-        return f"Từ {salary_min:,.0f} {currency} {interval_vi}"
+# Phần thay đổi theo từng lượt chat, gửi sau prefix; không chứa câu chữ cố định
+# để toàn bộ phần giống nhau giữa các lượt nằm trong prefix
+UNIFIED_DYNAMIC_SUFFIX = """
+INTENT: {intent}
+FILTERS (JSON): {filters_json}
 
-    return f"Đến {salary_max:,.0f} {currency} {interval_vi}"
+CONTEXT (các job, mỗi job có id, tiêu đề, công ty, lương, địa điểm, mô tả, yêu cầu, quyền lợi,...):
+----------------
+{context}
+----------------
 
+Câu hỏi của người dùng:
+"{question}"
+""".strip()
 
-def _get_company_name(meta: Dict[str, Any]) -> str:
-    company = meta.get("company")
-    if isinstance(company, dict):
-        return company.get("name") or ""
-    if isinstance(company, str):
-        return company
-    return ""
+# CONTEXT của job đang xem đã nằm trong CachedContent (_get_job_cached_model)
+_PINNED_CONTEXT_HEADER = "CONTEXT (job người dùng đang xem):\n"
+_PINNED_CONTEXT_NOTE = "(Xem CONTEXT của job người dùng đang xem ở đầu hội thoại.)"
 
+# tách sẵn template thành (literal, field) 1 lần lúc import
+_SUFFIX_PARTS: Tuple[Tuple[str, Optional[str]], ...] = tuple(
+    (literal, field) for literal, field, _, _ in string.Formatter().parse(UNIFIED_DYNAMIC_SUFFIX)
+)
 
-def _get_locations_text(meta: Dict[str, Any]) -> str:
-    locs = meta.get("locations") or []
-    if isinstance(locs, list):
-        return ", ".join([str(x) for x in locs if x])
-    return str(locs) if locs else ""
 
-# upper tiêu đề
-def _get_title_upper(meta: Dict[str, Any]) -> str:
-    title = meta.get("title") or ""
-    return title.upper()
+# giống UNIFIED_DYNAMIC_SUFFIX.format(**fields) nhưng không parse lại template,
+# ghép 1 lần bằng "".join
+def _build_answer_prompt(**fields: str) -> str:
+    parts: List[str] = []
+    for literal, field in _SUFFIX_PARTS:
+        parts.append(literal)
+        if field is not None:
+            parts.append(fields[field])
+    return "".join(parts)
 
-# metadata(kinh nghiệm) -> thành chuỗi dễ đọc
-def _format_experience_block(meta: Dict[str, Any]) -> str:
-    experience = meta.get("experience") or {}
-    months = experience.get("months")
-    raw_text = experience.get("raw_text") or meta.get("experience_raw_text")
+_unified_model: Optional[genai.GenerativeModel] = None
+# hết hạn của CachedContent đang dùng (None = model thường, không hết hạn)
+_unified_model_expires_at: Optional[float] = None
+_unified_model_lock = threading.Lock()
+
+_ANSWER_GENERATION_CONFIG = {
+    "temperature": 0.2,
+    "top_p": 0.9,
+    "top_k": 32,
+    "max_output_tokens": 512,
+}
+
+# settings không đổi trong lúc chạy -> đọc 1 lần lúc import, hot path dùng hằng số
+_DEFAULT_TOP_K = settings.RAG_DEFAULT_TOP_K
+_UNIFIED_MODEL_NAME = getattr(settings, "GEMINI_CHAT_MODEL", "") or "gemini-2.0-flash"
+_SECTION_CHAR_BUDGET = settings.RAG_SECTION_CHAR_BUDGET
+_CHUNK_CHAR_BUDGET = settings.RAG_CHUNK_CHAR_BUDGET
+_INCLUDE_CHUNK_TEXT = settings.RAG_INCLUDE_CHUNK_TEXT
+_MAX_HISTORY_TURNS = settings.RAG_MAX_HISTORY_TURNS
+_SHORTCIRCUIT_EMPTY = settings.RAG_SHORTCIRCUIT_EMPTY
+_QUICK_REPLY = settings.RAG_QUICK_REPLY
+_ANSWER_CACHE_SIZE = settings.LLM_ANSWER_CACHE_SIZE
+_ANSWER_CACHE_TTL_SECONDS = settings.LLM_ANSWER_CACHE_TTL_SECONDS
+_ANSWER_CACHE_DB_PATH = settings.LLM_ANSWER_CACHE_DB_PATH
+# chỉ cache khi bật và model gần như deterministic
+_ANSWER_CACHE_ENABLED = (
+    _ANSWER_CACHE_SIZE > 0 and _ANSWER_GENERATION_CONFIG["temperature"] <= 0.2
+)
+_SEMANTIC_CACHE_SIZE = settings.SEMANTIC_CACHE_SIZE
+_SEMANTIC_CACHE_THRESHOLD = settings.SEMANTIC_CACHE_THRESHOLD
+_RESPONSE_CACHE_SIZE = settings.CHAT_RESPONSE_CACHE_SIZE
+_RESPONSE_CACHE_TTL_SECONDS = settings.CHAT_RESPONSE_CACHE_TTL_SECONDS
+_RESPONSE_CACHE_HISTORY_TURNS = 3
+_JOB_MODEL_CACHE_SIZE = settings.GEMINI_JOB_CONTEXT_CACHE_SIZE
+_JOB_MODEL_CACHE_TTL_SECONDS = settings.GEMINI_JOB_CONTEXT_CACHE_TTL_SECONDS
+
+# model từ CachedContent (prefix + context job đang xem):
+# (job_id, sha1 context) -> model; model None = đang tạo / tạo lỗi.
+# _job_models_lock: tra + đánh dấu "đang tạo" trong 1 bước, không tạo trùng
+_job_models = TTLCache(_JOB_MODEL_CACHE_SIZE, _JOB_MODEL_CACHE_TTL_SECONDS)
+_job_models_lock = threading.Lock()
+_MISSING = object()
+
+# cache câu trả lời: sha1(câu hỏi | filters | doc_ids) -> text
+_answer_cache = TTLCache(_ANSWER_CACHE_SIZE, _ANSWER_CACHE_TTL_SECONDS)
+# bản lưu xuống SQLite (LLM_ANSWER_CACHE_DB_PATH) để còn cache sau khi restart;
+# 1 connection dùng chung, mọi truy cập đi qua _answer_db_lock
+_answer_db: Optional[sqlite3.Connection] = None
+_answer_db_failed = False
+_answer_db_lock = threading.Lock()
+
+# cache nguyên kết quả 1 lượt chat (bỏ qua cả parse + retrieve + Gemini):
+# sha1(câu hỏi | job đang xem | top_k | vài lượt history cuối)
+#   -> (answer thô, answer HTML, orjson [context_jobs, query_filters])
+# context_jobs / query_filters lưu dạng bytes: mỗi hit orjson.loads ra bản mới (C, nhanh),
+# không dùng chung dict/list với response trước
+_response_cache = TTLCache(_RESPONSE_CACHE_SIZE, _RESPONSE_CACHE_TTL_SECONDS)
+
+# semantic cache: embedding câu hỏi (đã normalize)
+# -> (answer, scope, job_id, doc_ids, expires_at)
+# scope = filters (JSON, có intent); job_id = job người dùng đang xem (current_job_id):
+# chỉ dùng lại câu trả lời cùng scope và cùng job
+# ring buffer: ma trận (SEMANTIC_CACHE_SIZE, d) cấp phát 1 lần + list song song, ghi đè
+# entry cũ nhất (FIFO) khi đầy -> put chỉ ghi 1 dòng, không vstack chép cả ma trận
+_semantic_vecs: Optional[np.ndarray] = None
+_semantic_entries: List[Optional[Tuple[str, str, Any, frozenset, float]]] = []
+_semantic_count = 0
+_semantic_next = 0
+_semantic_lock = threading.Lock()
+_SEMANTIC_TOP_N = 5
+
+# embedding retrieve của từng lượt: sha1(chuỗi câu user trong hội thoại)
+# -> (phần filter đã ghép vào query, vector)
+# dùng lại cho câu hỏi nối tiếp ngắn ("công việc thứ 2", "lương bao nhiêu?")
+_TURN_EMBEDDING_CACHE_SIZE = 2048
+_FOLLOWUP_MAX_CHARS = 40
+_TURN_KEY_USER_TURNS = 4
+_turn_embeddings = TTLCache(_TURN_EMBEDDING_CACHE_SIZE)
+
+# đoạn context đã format của từng doc: (job_id, doc_id, crawled_at, header, hash chunk) -> text
+_JOB_CONTEXT_CACHE_SIZE = 2048
+_job_context_cache = TTLCache(_JOB_CONTEXT_CACHE_SIZE)
+
+# chạy song song các bước I/O độc lập trong chat_with_rag (Gemini parse / DB)
+_RAG_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="rag")
+
+_NO_ANSWER_TEXT = "Hiện tại em chưa trả lời được câu hỏi này từ dữ liệu có sẵn."
+_NO_JOBS_TEXT = (
+    "Hiện mình chưa tìm thấy công việc phù hợp trong dữ liệu. "
+    "Bạn thử mô tả cụ thể hơn (địa điểm, kỹ năng, mức lương mong muốn) nhé."
+)
+_EMPTY_ANSWER_TEXT = (
+    "Mình chưa nhận được phản hồi rõ ràng từ mô hình. "
+    "Bạn thử hỏi lại một cách cụ thể hơn nhé."
+)
+# cắt text về tối đa n ký tự, ở ranh giới từ (n <= 0 -> giữ nguyên)
+def _truncate_text(text: str, n: int) -> str:
+    if n <= 0 or len(text) <= n:
+        return text
+    cut = text.rfind(" ", 0, n)
+    if cut <= 0:
+        cut = n
+    return text[:cut].rstrip() + "…"
+
+_SECTION_NAMES = {
+    "mo_ta_cong_viec": "Mô tả công việc",
+    "yeu_cau_ung_vien": "Yêu cầu ứng viên",
+    "quyen_loi": "Quyền lợi",
+    "phu_cap": "Phụ cấp",
+    "ky_nang": "Kỹ năng",
+    "phuc_loi": "Phúc lợi",
+}
+# ưu tiên; các section khác xếp sau, giữ nguyên thứ tự trong metadata (sort ổn định)
+_SECTION_ORDER = (
+    "mo_ta_cong_viec",
+    "yeu_cau_ung_vien",
+    "quyen_loi",
+    "phu_cap",
+)
+_SECTION_RANK = {key: i for i, key in enumerate(_SECTION_ORDER)}
+_SECTION_RANK_OTHER = len(_SECTION_ORDER)
+
+
+def _section_rank(key: str) -> int:
+    return _SECTION_RANK.get(key, _SECTION_RANK_OTHER)
 
-    if raw_text:
-        return raw_text
-    if months is None:
-        return ""
-    if months <= 0:
-        return "Không yêu cầu kinh nghiệm"
-    years = months // 12
-    remaining_months = months % 12
-    if years and remaining_months:
-        return f"Tối thiểu {years} năm {remaining_months} tháng kinh nghiệm"
-    if years:
-        return f"Tối thiểu {years} năm kinh nghiệm"
-    return f"Tối thiểu {months} tháng kinh nghiệm"
 
 # Lấy các đoạn mô tả chi tiết của job  Ưu tiên text_content, fallback html_content -> cho vào prompt
 def _extract_detail_sections(meta: Dict[str, Any]) -> List[str]:
@@ -167,154 +272,635 @@ def _extract_detail_sections(meta: Dict[str, Any]) -> List[str]:
     if not isinstance(sections, dict):
         return []
 
-    readable_names = {
-        "mo_ta_cong_viec": "Mô tả công việc",
-        "yeu_cau_ung_vien": "Yêu cầu ứng viên",
-        "quyen_loi": "Quyền lợi",
-        "phu_cap": "Phụ cấp",
-        "ky_nang": "Kỹ năng",
-        "phuc_loi": "Phúc lợi",
-    }
-    # ưu tiên
-    priority_order = [
-        "mo_ta_cong_viec",
-        "yeu_cau_ung_vien",
-        "quyen_loi",
-        "phu_cap",
-    ]
-
     detail_parts: List[str] = []
-    handled_keys = set()
-
-    def _append_section(key: str) -> None:
-        if key in handled_keys:
-            return
-        section = sections.get(key)
+    # 1 lượt duyệt đã sắp xếp, mỗi section xử lý đúng 1 lần
+    for key in sorted(sections, key=_section_rank):
+        section = sections[key]
         if not section:
-            return
-
-        text_content = None
-        html_content = None
+            continue
         if isinstance(section, dict):
-            text_content = section.get("text")
-            html_content = section.get("html")
+            content = section.get("text") or section.get("html")
         else:
-            text_content = str(section)
-
-        content = text_content or html_content
+            content = str(section)
         if content:
-            heading = readable_names.get(key, key)
+            heading = _SECTION_NAMES.get(key, key)
+            content = _truncate_text(content, _SECTION_CHAR_BUDGET)
             detail_parts.append(f"{heading}: {content}")
-            handled_keys.add(key)
-
-    for key in priority_order:
-        _append_section(key)
-
-    for key in sections.keys():
-        _append_section(key)
 
     return detail_parts
 
-#  Ghép các chunk lại thành 1 context text để đưa vào LLM.
-#    Ưu tiên include thông tin job_id, title, company cho dễ đọc.
-def build_context_text(retrieved_docs: List[Dict[str, Any]]) -> str:
-    parts: List[str] = []
-    for d in retrieved_docs:
-        meta = d.get("metadata") or {}
+_EXPERIENCE_REQ_LABEL = "Yêu cầu kinh nghiệm: "
+
+
+# 1 doc retrieve đã tính sẵn các field dùng cho cả context text lẫn context_jobs
+@dataclass(slots=True)
+class RetrievedJob:
+    doc_id: Any
+    job_id: Any
+    title: str
+    header: str
+    company_name: str
+    locations_text: str
+    salary_text: str
+    experience_text: str
+    chunk_text: str
+    meta: Dict[str, Any]
+    score: Optional[float]
+
+    @classmethod
+    def from_doc(
+        cls,
+        d: Dict[str, Any],
+        rendered_by_job: Optional[Dict[Any, Dict[str, Any]]] = None,
+    ) -> "RetrievedJob":
+        meta = d.get("metadata") or _EMPTY_DICT
         job_id = meta.get("id") or d.get("job_id")
-        title = meta.get("title") or ""
-        company_obj = meta.get("company") or {}
-        company_name = (
-            company_obj.get("name")
-            if isinstance(company_obj, dict)
-            else str(company_obj or "")
+        # ưu tiên bản render sẵn lúc index (embeddings.upsert_rag_doc_for_job)
+        rendered = meta.get("rendered")
+        if not isinstance(rendered, dict) or rendered.get("version") != _CONTEXT_RENDER_VERSION:
+            # doc index cũ: các chunk của cùng job có chung metadata job -> render 1 lần / job
+            rendered = rendered_by_job.get(job_id) if rendered_by_job is not None else None
+            if rendered is None:
+                rendered = render_job_fields(meta, job_id)
+                if rendered_by_job is not None and job_id is not None:
+                    rendered_by_job[job_id] = rendered
+        return cls(
+            doc_id=d.get("doc_id"),
+            job_id=job_id,
+            title=meta.get("title") or "",
+            header=rendered["header"],
+            company_name=rendered["company_name"],
+            locations_text=rendered["locations_text"],
+            salary_text=rendered["salary_text"],
+            experience_text=rendered["experience_text"],
+            chunk_text=d.get("chunk_text") or "",
+            meta=meta,
+            score=d.get("score"),
         )
 
-        header = f"[JOB {job_id}] {title} – {company_name}".strip()
-        salary_text = _format_salary_block(meta)
-        location_text = _get_locations_text(meta)
-        experience_text = _format_experience_block(meta)
-        details: List[str] = []
-        if salary_text:
-            details.append(f"lương: {salary_text}")
-        if location_text:
-            details.append(f"địa điểm: {location_text}")
-        if experience_text:
-            details.append(f"kinh nghiệm: {experience_text}")
-        if details:
-            header = f"{header} ({'; '.join(details)})"
-
-        chunk_text = d.get("chunk_text") or ""
-        sections: List[str] = [header]
-        if experience_text and experience_text not in chunk_text:
-            sections.append(f"Yêu cầu kinh nghiệm: {experience_text}")
-        detail_sections = _extract_detail_sections(meta)
-        sections.extend(detail_sections)
+    def to_context_job(self) -> Dict[str, Any]:
+        app_url = f"/jobs/{self.job_id}" if self.job_id is not None else self.meta.get("url")
+        return {
+            "job_id": self.job_id,
+            "title": self.title.upper(),
+            "company_name": self.company_name,
+            "locations": self.locations_text,
+            "salary_text": self.salary_text,
+            "url": app_url,
+            "score": self.score,
+        }
+
+
+def _as_retrieved_jobs(
+    docs: List[Union[RetrievedJob, Dict[str, Any]]]
+) -> List[RetrievedJob]:
+    rendered_by_job: Dict[Any, Dict[str, Any]] = {}
+    return [
+        d if isinstance(d, RetrievedJob) else RetrievedJob.from_doc(d, rendered_by_job)
+        for d in docs
+    ]
+
+
+# ngân sách context cho prompt: TTFT tăng theo số token đầu vào
+# (~3.5 ký tự / token với tiếng Việt -> 12000 ký tự ≈ 3.4k token)
+_MAX_CONTEXT_CHARS = settings.RAG_MAX_CONTEXT_CHARS
+_MAX_CONTEXT_DOCS = settings.RAG_MAX_CONTEXT_DOCS
+_RANKING_LABEL = "Thứ tự liên quan (job id): "
+
+
+# key ổn định để sắp xếp job trong context, không phụ thuộc score.
+# job_id số -> so theo số ("9" trước "10"); id không phải số xếp sau, so theo chuỗi
+def _context_sort_key(job: RetrievedJob) -> Tuple[int, int, str, str]:
+    doc_id = str(job.doc_id or "")
+    try:
+        return (0, int(job.job_id), "", doc_id)
+    except (TypeError, ValueError):
+        return (1, 0, str(job.job_id or ""), doc_id)
+
+
+def _format_job_context_uncached(job: RetrievedJob, with_details: bool = True) -> str:
+    details = _extract_detail_sections(job.meta) if with_details else []
+    # chunk là 1 đoạn của section -> đã có đủ section chi tiết thì không lặp lại
+    chunk_text = ""
+    if _INCLUDE_CHUNK_TEXT and not details:
+        chunk_text = _truncate_text(job.chunk_text, _CHUNK_CHAR_BUDGET)
+    # chỉ thêm phần khác rỗng -> join thẳng, không lọc lại cả list
+    sections: List[str] = [job.header] if job.header else []
+    if job.experience_text and job.experience_text not in chunk_text:
+        sections.append(_EXPERIENCE_REQ_LABEL + job.experience_text)
+    sections.extend(details)
+    if chunk_text:
         sections.append(chunk_text)
-        parts.append("\n".join([s for s in sections if s]))
+    return "\n".join(sections)
+
+
+# Đoạn context của 1 doc (header "[JOB id]" theo job_id nên không phụ thuộc vị trí).
+# Job phổ biến lặp lại giữa nhiều câu hỏi -> LRU; crawled_at + header đổi khi job
+# được crawl / index lại nên bản cũ tự hết hiệu lực.
+# with_details=False: bỏ các section chi tiết (đã có ở chunk khác của cùng job).
+def _format_job_context(job: RetrievedJob, with_details: bool = True) -> str:
+    key = (
+        job.job_id,
+        job.doc_id,
+        job.meta.get("crawled_at"),
+        job.header,
+        hashlib.blake2b(job.chunk_text.encode("utf-8"), digest_size=8).digest(),
+        with_details,
+    )
+    piece = _job_context_cache.get(key)
+    if piece is not None:
+        return piece
+
+    piece = _format_job_context_uncached(job, with_details)
+    _job_context_cache.put(key, piece)
+    return piece
 
+
+#  Ghép các chunk lại thành 1 context text để đưa vào LLM.
+#    Ưu tiên include thông tin job_id, title, company cho dễ đọc.
+#    Chọn job theo thứ tự score đến khi đủ max_chars (tính cả "\n\n" giữa các job)
+#    hoặc đủ max_docs doc, doc điểm thấp phía sau bị bỏ; section chi tiết của mỗi job
+#    chỉ đưa vào 1 lần (ở chunk được chọn đầu tiên), các chunk sau chỉ có header + chunk;
+#    rồi render theo job_id để cùng 1 tập job luôn ra cùng 1 chuỗi (cache prefix);
+#    thứ tự liên quan được ghi riêng ở dòng cuối (đã chừa chỗ trong max_chars).
+def build_context_text(
+    retrieved_docs: List[Union[RetrievedJob, Dict[str, Any]]],
+    max_chars: int = _MAX_CONTEXT_CHARS,
+    max_docs: int = _MAX_CONTEXT_DOCS,
+) -> str:
+    picked: List[Tuple[RetrievedJob, str]] = []
+    detailed_ids = set()
+    ranking: Dict[str, None] = {}
+    cut_piece = ""
+    total = 0
+    for job in _as_retrieved_jobs(retrieved_docs):
+        if total >= max_chars or (max_docs > 0 and len(picked) >= max_docs):
+            break
+
+        with_details = job.job_id is None or job.job_id not in detailed_ids
+        if with_details and job.job_id is not None:
+            detailed_ids.add(job.job_id)
+        piece = _format_job_context(job, with_details)
+
+        # chừa chỗ cho dòng thứ tự liên quan (tính cả job này) để tổng không vượt max_chars
+        next_ranking = ranking
+        if job.job_id is not None and str(job.job_id) not in ranking:
+            next_ranking = {**ranking, str(job.job_id): None}
+        reserve = _ranking_line_len(next_ranking)
+
+        if picked:
+            total += 2  # "\n\n"
+        if total + len(piece) + reserve > max_chars:
+            # job cuối vượt giới hạn: chỉ cắt phần này, để sau cùng
+            cut_piece = piece[: max(max_chars - total - reserve, 0)]
+            if cut_piece:
+                picked.append((job, ""))
+                ranking = next_ranking
+            break
+        picked.append((job, piece))
+        ranking = next_ranking
+        total += len(piece)
+
+    parts = [piece for _, piece in sorted(
+        ((job, piece) for job, piece in picked if piece),
+        key=lambda item: _context_sort_key(item[0]),
+    )]
+    if cut_piece:
+        parts.append(cut_piece)
+    if len(ranking) > 1:
+        parts.append(_RANKING_LABEL + ", ".join(ranking))
     return "\n\n".join(parts)
 
+
+# Độ dài dòng thứ tự liên quan (kèm "\n\n" phía trước); chỉ có khi >= 2 job
+def _ranking_line_len(ranking: Dict[str, None]) -> int:
+    if len(ranking) < 2:
+        return 0
+    return 2 + len(_RANKING_LABEL) + sum(len(r) for r in ranking) + 2 * (len(ranking) - 1)
+
 def _get_unified_model() -> genai.GenerativeModel:
-    global _unified_model
-    if _unified_model is not None:
+    """
+    Model trả lời với UNIFIED_STATIC_PREFIX làm system instruction.
+    Nếu bật GEMINI_CONTEXT_CACHE thì đăng ký prefix bằng CachedContent
+    (prefix quá ngắn / model không hỗ trợ -> fallback model thường).
+    """
+    global _unified_model, _unified_model_expires_at
+
+    def _usable() -> bool:
+        return _unified_model is not None and (
+            _unified_model_expires_at is None
+            or _unified_model_expires_at > time.monotonic()
+        )
+
+    if _usable():
         return _unified_model
 
-    api_key = getattr(settings, "GEMINI_API_KEY", "") or ""
-    if not api_key:
-        raise RuntimeError("GEMINI_API_KEY chưa được cấu hình.")
+    with _unified_model_lock:
+        if _usable():
+            return _unified_model
+
+        configure_gemini()
+        model_name = _UNIFIED_MODEL_NAME
+
+        if settings.GEMINI_CONTEXT_CACHE:
+            ttl = settings.GEMINI_CONTEXT_CACHE_TTL_SECONDS
+            try:
+                cached = genai.caching.CachedContent.create(
+                    model=model_name,
+                    system_instruction=UNIFIED_STATIC_PREFIX,
+                    ttl=datetime.timedelta(seconds=ttl),
+                )
+                _unified_model = genai.GenerativeModel.from_cached_content(cached)
+                # làm mới sớm hơn TTL một chút
+                _unified_model_expires_at = time.monotonic() + max(ttl - 60, 60)
+                return _unified_model
+            except Exception as e:
+                logger.warning("Không tạo được Gemini context cache, dùng model thường: %s", e)
+
+        _unified_model = genai.GenerativeModel(
+            model_name, system_instruction=UNIFIED_STATIC_PREFIX
+        )
+        _unified_model_expires_at = None
+        return _unified_model
+
+
+def _create_job_cached_model(key: Tuple[Any, str], context_text: str) -> None:
+    ttl = _JOB_MODEL_CACHE_TTL_SECONDS
+    model: Optional[genai.GenerativeModel] = None
+    try:
+        configure_gemini()
+        cached = genai.caching.CachedContent.create(
+            model=_UNIFIED_MODEL_NAME,
+            system_instruction=UNIFIED_STATIC_PREFIX,
+            contents=[{"role": "user", "parts": [_PINNED_CONTEXT_HEADER + context_text]}],
+            ttl=datetime.timedelta(seconds=ttl),
+        )
+        model = genai.GenerativeModel.from_cached_content(cached)
+    except Exception as e:
+        # thường do context quá ngắn so với mức tối thiểu của cache -> không thử lại tới hết TTL
+        logger.info("Không tạo được context cache cho job %s: %s", key[0], e)
+    _job_models.put(key, model, ttl_seconds=max(ttl - 60, 60))
+
+
+def _get_job_cached_model(job_id: Any, context_text: str) -> Optional[genai.GenerativeModel]:
+    """
+    Model có sẵn prefix + context của job đang xem trong CachedContent, để các lượt
+    hỏi tiếp về cùng job chỉ gửi phần thay đổi. Lần đầu: tạo nền trong _RAG_POOL
+    và trả None (lượt này dùng model thường), không bắt người dùng chờ tạo cache.
+    """
+    if not settings.GEMINI_CONTEXT_CACHE or not _job_models.enabled or job_id is None:
+        return None
+    key = (job_id, hashlib.sha1(context_text.encode("utf-8")).hexdigest())
+    with _job_models_lock:
+        model = _job_models.get(key, _MISSING)
+        if model is not _MISSING:
+            return model
+        # đánh dấu đang tạo để request khác không tạo trùng
+        _job_models.put(key, None)
+    _RAG_POOL.submit(_create_job_cached_model, key, context_text)
+    return None
+
+
+def _doc_ids(jobs: List[RetrievedJob]) -> List[str]:
+    return sorted(str(j.doc_id or j.job_id) for j in jobs)
+
+
+# Key cache: câu hỏi đã chuẩn hoá + filters + tập doc đã retrieve
+def _answer_cache_key(
+    user_message: str, filters_json: str, retrieved_docs: List[RetrievedJob]
+) -> str:
+    raw = "|".join(
+        [
+            " ".join(user_message.lower().split()),
+            filters_json,
+            ",".join(_doc_ids(retrieved_docs)),
+        ]
+    )
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
 
-    model_name = getattr(settings, "GEMINI_CHAT_MODEL", "") or "gemini-2.0-flash"
+def _answer_cacheable(filters: Dict[str, Any]) -> bool:
+    return _ANSWER_CACHE_ENABLED and (filters.get("intent") or "other") != "other"
 
-    genai.configure(api_key=api_key)
-    _unified_model = genai.GenerativeModel(model_name)
-    return _unified_model
 
-def generate_answer_unified(
-    user_message: str, filters: Dict[str, Any], retrieved_docs: List[Dict[str, Any]]
+# gọi khi đang giữ _answer_db_lock; không cấu hình / mở lỗi -> None (chỉ cache trong RAM)
+def _get_answer_db() -> Optional[sqlite3.Connection]:
+    global _answer_db, _answer_db_failed
+    if _answer_db is not None or _answer_db_failed or not _ANSWER_CACHE_DB_PATH:
+        return _answer_db
+    try:
+        conn = sqlite3.connect(_ANSWER_CACHE_DB_PATH, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_answer_cache ("
+            "k TEXT PRIMARY KEY, v TEXT NOT NULL, ts INTEGER NOT NULL)"
+        )
+        conn.commit()
+        _answer_db = conn
+    except sqlite3.Error as e:
+        logger.warning("Không mở được SQLite answer cache %s: %s", _ANSWER_CACHE_DB_PATH, e)
+        _answer_db_failed = True
+    return _answer_db
+
+
+# ts lưu theo giờ hệ thống (monotonic không dùng được qua các lần restart)
+def _answer_db_get(key: str) -> Optional[Tuple[float, str]]:
+    with _answer_db_lock:
+        db = _get_answer_db()
+        if db is None:
+            return None
+        try:
+            row = db.execute(
+                "SELECT v, ts FROM llm_answer_cache WHERE k = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("Đọc SQLite answer cache lỗi: %s", e)
+            return None
+    if row is None:
+        return None
+    text, ts = row
+    remaining = ts + _ANSWER_CACHE_TTL_SECONDS - time.time()
+    if remaining <= 0:
+        return None
+    return remaining, text
+
+
+def _answer_db_put(key: str, text: str) -> None:
+    with _answer_db_lock:
+        db = _get_answer_db()
+        if db is None:
+            return
+        try:
+            now = int(time.time())
+            db.execute(
+                "INSERT OR REPLACE INTO llm_answer_cache (k, v, ts) VALUES (?, ?, ?)",
+                (key, text, now),
+            )
+            db.execute(
+                "DELETE FROM llm_answer_cache WHERE ts < ?",
+                (now - _ANSWER_CACHE_TTL_SECONDS,),
+            )
+            db.commit()
+        except sqlite3.Error as e:
+            logger.warning("Ghi SQLite answer cache lỗi: %s", e)
+
+
+def _answer_cache_get(key: str) -> Optional[str]:
+    text = _answer_cache.get(key)
+    if text is not None:
+        return text
+    # RAM miss -> thử bản lưu SQLite (sau restart), hit thì nạp lại vào RAM
+    if not _ANSWER_CACHE_DB_PATH:
+        return None
+    stored = _answer_db_get(key)
+    if stored is None:
+        return None
+    remaining, text = stored
+    _answer_cache.put(key, text, ttl_seconds=remaining)
+    return text
+
+
+def _answer_cache_put(key: str, text: str) -> None:
+    _answer_cache.put(key, text)
+    if _ANSWER_CACHE_DB_PATH:
+        _answer_db_put(key, text)
+
+
+def _response_cache_key(
+    user_message: str, history: List[Dict[str, str]], current_job_id: Any, top_k: int
 ) -> str:
-    model = _get_unified_model()
+    recent = "\x1f".join(
+        (t.get("content") or "").strip() for t in history[-_RESPONSE_CACHE_HISTORY_TURNS:]
+    )
+    raw = "|".join(
+        [" ".join(user_message.lower().split()), str(current_job_id), str(top_k), recent]
+    )
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _response_cache_get(
+    key: str,
+) -> Optional[Tuple[str, str, List[Dict[str, Any]], Dict[str, Any]]]:
+    item = _response_cache.get(key)
+    if item is None:
+        return None
+    answer_raw, answer_html, payload = item
+    context_jobs, query_filters = orjson.loads(payload)
+    return answer_raw, answer_html, context_jobs, query_filters
+
+
+def _response_cache_put(
+    key: str,
+    answer_raw: str,
+    answer_html: str,
+    context_jobs: List[Dict[str, Any]],
+    query_filters: Dict[str, Any],
+) -> None:
+    payload = orjson.dumps([context_jobs, query_filters], default=str)
+    _response_cache.put(key, (answer_raw, answer_html, payload))
+
+
+# filters serialize ổn định (sort key) cho cache key / prompt / semantic scope
+def _filters_json(filters: Optional[Dict[str, Any]]) -> str:
+    return orjson.dumps(filters or {}, default=str, option=orjson.OPT_SORT_KEYS).decode("utf-8")
+
+
+# Tìm câu hỏi gần nghĩa đã trả lời: cosine >= ngưỡng, cùng scope (filters), cùng job
+# đang xem, và tập doc lúc đó chứa toàn bộ doc hiện tại.
+# Hỏi chi tiết 1 job thì mọi câu đều ra cùng tập doc -> không dựa riêng vào cosine
+def _semantic_cache_get(
+    vec: np.ndarray, scope: str, job_id: Any, doc_ids: frozenset
+) -> Optional[str]:
+    with _semantic_lock:
+        n = _semantic_count
+        if _semantic_vecs is None or n == 0:
+            return None
+        # 1 GEMV trên các dòng đã ghi; chỉ cần vài điểm cao nhất -> argpartition, không sort cả
+        scores = _semantic_vecs[:n] @ vec
+        if n > _SEMANTIC_TOP_N:
+            top = np.argpartition(scores, n - _SEMANTIC_TOP_N)[n - _SEMANTIC_TOP_N:]
+        else:
+            top = np.arange(n)
+        top = top[np.argsort(-scores[top])]
+        now = time.monotonic()
+        for idx in top:
+            if scores[idx] < _SEMANTIC_CACHE_THRESHOLD:
+                break
+            answer, cached_scope, cached_job_id, cached_ids, expires_at = _semantic_entries[idx]
+            if (
+                expires_at >= now
+                and cached_scope == scope
+                and cached_job_id == job_id
+                and doc_ids <= cached_ids
+            ):
+                return answer
+    return None
+
+
+def _semantic_cache_put(
+    vec: np.ndarray, answer: str, scope: str, job_id: Any, doc_ids: frozenset
+) -> None:
+    global _semantic_vecs, _semantic_count, _semantic_next
+    expires_at = time.monotonic() + _ANSWER_CACHE_TTL_SECONDS
+    with _semantic_lock:
+        if _semantic_vecs is None:
+            _semantic_vecs = np.zeros((_SEMANTIC_CACHE_SIZE, vec.shape[0]), dtype=np.float32)
+            _semantic_entries[:] = [None] * _SEMANTIC_CACHE_SIZE
+        idx = _semantic_next
+        _semantic_vecs[idx] = vec
+        _semantic_entries[idx] = (answer, scope, job_id, doc_ids, expires_at)
+        _semantic_next = (idx + 1) % _SEMANTIC_CACHE_SIZE
+        _semantic_count = min(_semantic_count + 1, _SEMANTIC_CACHE_SIZE)
+
+
+# Số token prompt / token lấy từ cache prefix (implicit hoặc CachedContent) / token trả lời,
+# để kiểm tra prefix tĩnh có thực sự được cache không (chỉ khi bật log DEBUG)
+def _log_usage(resp) -> None:
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    usage = getattr(resp, "usage_metadata", None)
+    if usage is None:
+        return
+    logger.debug(
+        "Gemini usage: prompt=%s cached=%s output=%s",
+        getattr(usage, "prompt_token_count", None),
+        getattr(usage, "cached_content_token_count", None),
+        getattr(usage, "candidates_token_count", None),
+    )
+
+
+# Lấy text từ response (hoặc 1 chunk khi stream).
+# .text đã tự ghép candidates[0].content.parts; raise ValueError nếu không có part (bị chặn / rỗng)
+def _response_text(resp) -> str:
+    try:
+        return resp.text or ""
+    except ValueError:
+        return ""
+
+
+def stream_answer_unified(
+    user_message: str,
+    filters: Dict[str, Any],
+    retrieved_docs: List[Union[RetrievedJob, Dict[str, Any]]],
+    pinned_job_id: Any = None,
+) -> Iterator[str]:
+    """
+    Stream câu trả lời (text thô, chưa _clean_answer) theo từng chunk của Gemini.
+    Cache hit -> yield 1 lần cả câu. Hết stream mới ghi cache.
+    pinned_job_id: context chỉ gồm doc của job đang xem -> dùng context cache theo job.
+    """
+    retrieved_docs = _as_retrieved_jobs(retrieved_docs)
+    # serialize filters 1 lần (sort key) dùng chung cho cache key và prompt
+    filters_json = _filters_json(filters)
+    cache_key = None
+    if _answer_cacheable(filters):
+        cache_key = _answer_cache_key(user_message, filters_json, retrieved_docs)
+        cached = _answer_cache_get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+
     context_text = build_context_text(retrieved_docs)
-    filters_json = json.dumps(filters or {}, ensure_ascii=False)
-    prompt = UNIFIED_PROMPT.format(
-        system_prompt=SYSTEM_PROMPT,
+    model = None
+    if pinned_job_id is not None:
+        model = _get_job_cached_model(pinned_job_id, context_text)
+        if model is not None:
+            context_text = _PINNED_CONTEXT_NOTE
+    if model is None:
+        model = _get_unified_model()
+    prompt = _build_answer_prompt(
         intent=(filters.get("intent") or "other"),
         filters_json=filters_json,
-        context=context_text[:12000],
+        context=context_text,
         question=user_message,
     )
     resp = model.generate_content(
         prompt,
-        generation_config={
-            "temperature": 0.2,
-            "top_p": 0.9,
-            "top_k": 32,
-            "max_output_tokens": 512,
-        },
+        generation_config=_ANSWER_GENERATION_CONFIG,
+        stream=True,
     )
-    text = ""
-    try:
-        candidates = getattr(resp, "candidates", None) or []
-        if candidates:
-            cand = candidates[0]
-            content = getattr(cand, "content", None)
-            parts = getattr(content, "parts", None) if content is not None else None
-            if parts:
-                buf: List[str] = []
-                for p in parts:
-                    t = getattr(p, "text", None)
-                    if t:
-                        buf.append(t)
-                text = "".join(buf).strip()
-        if not text:
-            raw = getattr(resp, "text", None)
-            if raw:
-                text = raw.strip()
-    except Exception:
-        raw = getattr(resp, "text", None)
-        if raw:
-            text = raw.strip()
-    return text or "Hiện tại em chưa trả lời được câu hỏi này từ dữ liệu có sẵn."
+    buf: List[str] = []
+    for chunk in resp:
+        piece = _response_text(chunk)
+        if not piece:
+            continue
+        if not buf:
+            piece = piece.lstrip()
+            if not piece:
+                continue
+        buf.append(piece)
+        yield piece
+    _log_usage(resp)
+
+    text = "".join(buf).strip()
+    if not text:
+        yield _NO_ANSWER_TEXT
+        return
+    if cache_key is not None:
+        _answer_cache_put(cache_key, text)
+
+
+def generate_answer_unified(
+    user_message: str,
+    filters: Dict[str, Any],
+    retrieved_docs: List[Union[RetrievedJob, Dict[str, Any]]],
+) -> str:
+    return "".join(stream_answer_unified(user_message, filters, retrieved_docs)).strip()
+
+# Key của 1 lượt: tối đa _TURN_KEY_USER_TURNS câu user gần nhất (tính cả câu hiện tại).
+# Cửa sổ cố định nên key không đổi khi history bị cắt bớt đầu (_clip_history).
+def _turn_key(user_messages: List[str]) -> str:
+    window = user_messages[-_TURN_KEY_USER_TURNS:]
+    return hashlib.sha1("\x1f".join(window).encode("utf-8")).hexdigest()
+
+
+# Giữ tối đa RAG_MAX_HISTORY_TURNS tin nhắn cuối, bỏ phần tử sai định dạng (1 lượt duyệt)
+def _clip_history(history: List[Any]) -> List[Dict[str, str]]:
+    max_turns = _MAX_HISTORY_TURNS
+    if max_turns <= 0:
+        return []
+    return [
+        t
+        for t in history[-max_turns:]
+        if isinstance(t, dict) and isinstance(t.get("content"), str)
+    ]
+
+
+def _user_turns(history: List[Dict[str, str]]) -> List[str]:
+    return [
+        (t.get("content") or "").strip()
+        for t in history
+        if isinstance(t, dict) and t.get("role") == "user"
+    ]
+
+
+# Câu nối tiếp ngắn -> lấy lại embedding retrieve của lượt user trước (nếu còn cache).
+# Vector đã ghép filter của lượt trước -> chỉ dùng lại khi filter lượt này giống hệt
+# (vd "ở Hà Nội thì sao?" đổi địa điểm thì phải embed lại)
+def _reuse_followup_embedding(
+    user_message: str, history: List[Dict[str, str]], filters_text: str
+) -> Optional[List[float]]:
+    if not history or len(user_message) >= _FOLLOWUP_MAX_CHARS:
+        return None
+    prev_turns = _user_turns(history)
+    if not prev_turns:
+        return None
+    key = _turn_key(prev_turns)
+    hit = _turn_embeddings.get(key)
+    if hit is None or hit[0] != filters_text:
+        return None
+    return hit[1]
+
+
+def _remember_turn_embedding(
+    user_message: str,
+    history: List[Dict[str, str]],
+    filters_text: str,
+    vec: List[float],
+) -> None:
+    key = _turn_key(_user_turns(history) + [user_message])
+    _turn_embeddings.put(key, (filters_text, vec))
+
 
 # Ghép thêm vài lượt hội thoại gần nhất để model retrieve không bị lạc ngữ cảnh
 def _build_retrieval_query(user_message: str, history: List[Dict[str, str]]) -> str:
@@ -322,176 +908,431 @@ def _build_retrieval_query(user_message: str, history: List[Dict[str, str]]) ->
     if not history:
         return base
     # Lấy tối đa 4 lượt cuối, nối thành 1 đoạn ngắn gọn để embedding.
+    # Giới hạn độ dài để tránh làm loãng embedding: duyệt từ lượt mới nhất, đủ
+    # max_len ký tự thì dừng (các lượt cũ hơn đằng nào cũng bị cắt bỏ).
+    max_len = 800
     tail_turns: List[str] = []
-    for turn in history[-4:]:
+    total = -3  # độ dài sau khi join: n lượt có n - 1 dấu " | "
+    for turn in reversed(history[-4:]):
         content = (turn.get("content") or "").strip()
         if content:
             tail_turns.append(content)
+            total += len(content) + 3
+            if total >= max_len:
+                break
     if not tail_turns:
         return base
+    tail_turns.reverse()
     history_text = " | ".join(tail_turns)
-
-    # Giới hạn độ dài để tránh làm loãng embedding.
-    max_len = 800
     if len(history_text) > max_len:
         history_text = history_text[-max_len:]
     if base:
         return f"{base} | Ngữ cảnh trước đó: {history_text}"
     return history_text
 
-#  phân loại ý định cơ bản
-def _is_greeting_only(message: str) -> bool:
-    text = (message or "").strip().lower()
-    if not text:
-        return False
+# Câu chào / hỏi về chatbot thuần tuý (khớp NGUYÊN câu, không dò keyword con để tránh
+# nhầm kiểu "hi" trong "chi tiết") -> trả lời mẫu, bỏ qua parse + retrieve + Gemini
+_QUICK_FILLER = r"(?:\s+(?:ạ|nha|nhé|nhe|vậy|thế|ơi))*"
+_GREETING_ONLY_RE = re.compile(
+    r"(?:xin\s+)?(?:chào|hello|hi|hey|alo)"
+    r"(?:\s+(?:bạn|anh|chị|em|ad|admin|bot|shop|mọi người|cả nhà))?"
+    + _QUICK_FILLER
+)
+_BOT_META_RE = re.compile(
+    r"(?:bạn|bot)\s+(?:"
+    r"là\s+ai|là\s+gì|tên\s+(?:là\s+)?gì"
+    r"|(?:có\s+thể\s+)?(?:làm|giúp)\s+(?:được\s+)?(?:những\s+)?(?:gì|việc\s+gì)"
+    r")"
+    + _QUICK_FILLER
+)
+_QUICK_TRIM = " \t\r\n!?.,~:;)"
+
+_GREETING_REPLY = (
+    "Chào bạn! Mình là trợ lý tuyển dụng của JobFinder. "
+    "Bạn muốn tìm việc theo vị trí, kỹ năng, địa điểm, mức lương, "
+    "hay cần hỏi chi tiết về một công việc cụ thể?"
+)
+_BOT_META_REPLY = (
+    "Mình là trợ lý tuyển dụng của JobFinder. Mình có thể giúp bạn tìm việc theo vị trí, "
+    "kỹ năng, địa điểm, mức lương, so sánh các công việc hoặc giải đáp chi tiết về một "
+    "tin tuyển dụng. Bạn đang quan tâm công việc nào?"
+)
+
+
+# "greet" / "meta" nếu cả câu chỉ là lời chào / câu hỏi về chatbot, còn lại None
+def _quick_reply_kind(message: str) -> Optional[str]:
+    text = " ".join(unicodedata.normalize("NFC", message).lower().split()).strip(_QUICK_TRIM)
+    if len(text) > 40:
+        return None
+    if _GREETING_ONLY_RE.fullmatch(text):
+        return "greet"
+    if _BOT_META_RE.fullmatch(text):
+        return "meta"
+    return None
 
-    greeting_keywords = [
-        "xin chào", "chào bạn", "chào anh", "chào chị", "hello", "hi", "alo", "chào", "hey",
-    ]
 
-    job_intent_keywords = [
-        "công việc", "job", "tuyển", "ứng tuyển", "việc làm", "lương", "tìm",
-    ]
-    if any(k in text for k in job_intent_keywords):
-        return False
-    # Câu chào thường ngắn, không kèm yêu cầu rõ.
-    return any(k in text for k in greeting_keywords)
+# clean html của câu trả lời do  /jobs/123 hoặc jobs/123 -> <a href="/jobs/123">Xem chi tiết</a>
+# 1 lần quét: markdown link [text](/jobs/123) hoặc đường dẫn trần /jobs/123.
+# Đường dẫn trần không được dính vào URL/từ phía trước (https://topcv.vn/jobs/1,
+# myjobs/1) -> giữ nguyên thay vì chèn <a> vào giữa URL
+_JOB_LINK_RE = re.compile(r"\[([^\]]+)\]\((/?jobs/\d+)\)|(?<![\w/.:])/?jobs/\d+")
+
+
+def _job_link_repl(m: "re.Match[str]") -> str:
+    if m.group(1) is not None:
+        return f'<a href="/{m.group(2).lstrip("/")}" class="chat-link">{m.group(1)}</a>'
+    return f'<a href="/{m.group(0).lstrip("/")}" class="chat-link">Xem chi tiết</a>'
 
 
-# clean html của câu trả lời do  /jobs/123 hoặc jobs/123 -> <a href="/jobs/123">Xem chi tiết</a>
 def _markdown_links_to_html(text: str) -> str:
     if not text:
         return ""
-    # Chỉ convert markdown có URL nội bộ /jobs/xxx 
-    md_pattern = re.compile(r"\[([^\]]+)\]\((/?jobs/\d+)\)")
-    text = md_pattern.sub(
-        lambda m: (
-            f'<a href="/{m.group(2).lstrip("/")}" class="chat-link">{m.group(1)}</a>'
-        ),
-        text,
-    )
-    # Convert đường dẫn /jobs/123 hoặc jobs/123 thành link có "Xem chi tiết"
-    url_pattern = re.compile(r"/?jobs/\d+")
-    text = url_pattern.sub(lambda m: f'<a href="/{m.group(0).lstrip("/")}" class="chat-link">Xem chi tiết</a>', text)
+    # Chỉ convert markdown có URL nội bộ /jobs/xxx, đường dẫn trần -> "Xem chi tiết"
+    return _JOB_LINK_RE.sub(_job_link_repl, text)
+
+
+_WS_RE = re.compile(r"[ \t]+")
+_BULLET_RE = re.compile(r"(?<!^)(?<!\n)\s*-\s+")
+_BLANKS_RE = re.compile(r"\n{3,}")
+# bullet "•" (U+2022) -> "- ", nbsp -> space và escape html (như html.escape) trong
+# cùng 1 lần quét; escape không sinh khoảng trắng / "-" nên làm trước các bước dưới được
+_CLEAN_TABLE = str.maketrans(
+    {
+        "\u2022": "- ",
+        "\xa0": " ",
+        "&": "&amp;",
+        "<": "&lt;",
+        ">": "&gt;",
+        '"': "&quot;",
+        "'": "&#x27;",
+    }
+)
+
+# gộp space/tab liên tiếp; câu trả lời thường không có -> bỏ qua regex
+def _collapse_ws(text: str) -> str:
+    if "  " in text or "\t" in text:
+        return _WS_RE.sub(" ", text)
     return text
 
-# Dọn các ký tự lạ / xuống dòng cho dễ đọc, Trả về HTML
+
+# Dọn các ký tự lạ / xuống dòng cho dễ đọc, Trả về HTML.
+# Cache theo text thô: câu trả lời lấy từ answer/semantic cache lặp lại nguyên văn
+@lru_cache(maxsize=1024)
 def _clean_answer(text: str) -> str:
     if not text:
         return ""
-    text = text.replace("\u2022", "- ").replace("•", "- ")
-
-    # loại bỏ khoảng trắng lạ
-    text = text.replace("\xa0", " ")
-    text = re.sub(r"[ \t]+", " ", text)
+    # bullet lạ + khoảng trắng lạ + escape html
+    text = _collapse_ws(text.translate(_CLEAN_TABLE))
     # ép các bullet đứng trên dòng riêng nếu model trả về liền mạch
-    text = re.sub(r"(?<!^)(?<!\n)\s*-\s+", "\n- ", text)
+    if "-" in text:
+        text = _BULLET_RE.sub("\n- ", text)
     # gọn bớt nhiều dòng trống liên tiếp
-    text = re.sub(r"\n{3,}", "\n\n", text)
+    if "\n\n\n" in text:
+        text = _BLANKS_RE.sub("\n\n", text)
     text = text.strip()
 
-    text = html.escape(text)
-    text = _markdown_links_to_html(text)
-    # cuối cùng: đổi \n thành <br> để xuống dòng
-    text = text.replace("\n\n", "<br><br>")
-    text = text.replace("\n", "<br>")
+    # đổi \n thành <br> để xuống dòng (\n\n -> <br><br>); link job đổi sau cũng được
+    # vì URL không chứa \n, còn text của link có <br> thì vẫn giữ nguyên như trước
+    if "\n" in text:
+        text = text.replace("\n", "<br>")
+    # câu trả lời ngắn (ask_detail / other) thường không có link job
+    if "jobs/" in text:
+        text = _markdown_links_to_html(text)
 
     return text
 
-# nhận câu hỏi + history (+ job_id đang xem) → RAG retrieve → Gemini generate.
-#Trả về:
-#    {
-#      "answer": "<HTML>",       # đã có <br>, <a>...
-#      "context_jobs": [ ... ],  # dùng cho gợi ý job ở UI
-#      "query_filters": { ... }  # phân tích cấu trúc từ câu hỏi người dùng
-#    }
-#    """
-def chat_with_rag(
+# câu trả lời cố định -> HTML dựng 1 lần lúc import
+_NO_JOBS_HTML = _clean_answer(_NO_JOBS_TEXT)
+_EMPTY_ANSWER_HTML = _clean_answer(_EMPTY_ANSWER_TEXT)
+# loại câu (_quick_reply_kind) -> (text thô, HTML)
+_QUICK_REPLIES = {
+    "greet": (_GREETING_REPLY, _clean_answer(_GREETING_REPLY)),
+    "meta": (_BOT_META_REPLY, _clean_answer(_BOT_META_REPLY)),
+}
+
+
+class _AnswerHtmlLines:
+    """
+    Bản HTML tạm của câu trả lời khi đang stream, theo từng dòng thô đã hoàn chỉnh
+    (link markdown không vắt qua dòng nên convert được ngay). Mỗi dòng thô -> đúng 1
+    đoạn HTML (đã kèm <br>, "" nếu dòng trống bị gộp) để FE ghép với phần text đang hiện.
+    Dọn dẹp giống _clean_answer; khi "done" FE vẫn thay bằng bản _clean_answer đầy đủ.
+    """
+
+    __slots__ = ("_buf", "_started", "_prev_blank")
+
+    def __init__(self) -> None:
+        self._buf = ""
+        self._started = False
+        self._prev_blank = False
+
+    def feed(self, piece: str) -> List[str]:
+        self._buf += piece
+        if "\n" not in self._buf:
+            return []
+        *lines, self._buf = self._buf.split("\n")
+        return [self._line_html(line) for line in lines]
+
+    def _line_html(self, line: str) -> str:
+        line = _collapse_ws(line.translate(_CLEAN_TABLE)).strip()
+        if not line:
+            # bỏ dòng trống đầu câu trả lời, gộp nhiều dòng trống liên tiếp
+            if not self._started or self._prev_blank:
+                return ""
+            self._prev_blank = True
+            return "<br>"
+        self._started = True
+        self._prev_blank = False
+        if "-" in line:
+            line = _BULLET_RE.sub("\n- ", line).replace("\n", "<br>")
+        if "jobs/" in line:
+            line = _markdown_links_to_html(line)
+        return line + "<br>"
+
+
+def _delta_event(html_lines: _AnswerHtmlLines, piece: str) -> Dict[str, Any]:
+    event: Dict[str, Any] = {"type": "delta", "text": piece}
+    lines = html_lines.feed(piece)
+    if lines:
+        event["lines"] = lines
+    return event
+
+
+# Chuẩn hoá danh sách job để FE dùng (gợi ý job): 1 job nhiều chunk -> 1 mục,
+# giữ vị trí chunk xếp hạng cao nhất (docs đã theo thứ tự ghim + score)
+def _build_context_jobs(jobs: List[RetrievedJob]) -> List[Dict[str, Any]]:
+    seen_ids = set()
+    context_jobs: List[Dict[str, Any]] = []
+    for j in jobs:
+        if j.job_id is not None:
+            if j.job_id in seen_ids:
+                continue
+            seen_ids.add(j.job_id)
+        context_jobs.append(j.to_context_job())
+    return context_jobs
+
+
+# chạy nền; lỗi sẽ được thử lại (và báo) ở lần gọi thật trong stream_answer_unified
+def _warm_unified_model() -> None:
+    try:
+        _get_unified_model()
+    except Exception as e:
+        logger.warning("Không khởi tạo trước được model trả lời: %s", e)
+
+
+def _chat_error(answer: str) -> Dict[str, Any]:
+    return {"type": "done", "answer": answer, "context_jobs": []}
+
+
+# nhận câu hỏi + history (+ job_id đang xem) → RAG retrieve → Gemini generate (stream).
+# Yield các event:
+#    {"type": "context", "context_jobs": [...]}  # ngay sau retrieve, trước khi gọi Gemini
+#    {"type": "delta", "text": "...", "lines": ["<HTML>", ...]}
+#        # text thô từng đoạn (chưa escape) + HTML của các dòng vừa hoàn chỉnh (nếu có)
+#    {"type": "done", "answer": "<HTML>", "context_jobs": [...], "query_filters": {...}}
+def chat_with_rag_stream(
     user_message: str,
     history: Optional[List[Dict[str, str]]] = None,
     *,
     current_job_id: Optional[int] = None,
     top_k: Optional[int] = None,
-) -> Dict[str, Any]:
-    history = history or []
+) -> Iterator[Dict[str, Any]]:
+    history = _clip_history(history or [])
     user_message = (user_message or "").strip()
     if not user_message:
         logger.info("Chặn trả lời do tin nhắn trống từ người dùng.")
-        return {
-            "answer": "Bạn hãy nhập câu hỏi về công việc, mức lương hoặc kỹ năng nhé.",
+        yield _chat_error("Bạn hãy nhập câu hỏi về công việc, mức lương hoặc kỹ năng nhé.")
+        return
+
+    # lời chào / hỏi chatbot là ai: không cần dữ liệu việc làm lẫn Gemini
+    quick_kind = _quick_reply_kind(user_message) if _QUICK_REPLY else None
+    if quick_kind is not None:
+        reply_text, reply_html = _QUICK_REPLIES[quick_kind]
+        yield {"type": "context", "context_jobs": []}
+        yield {"type": "delta", "text": reply_text}
+        yield {
+            "type": "done",
+            "answer": reply_html,
             "context_jobs": [],
+            "query_filters": {"intent": "other"},
         }
+        return
+
+    k = top_k or _DEFAULT_TOP_K
+
+    # cùng câu hỏi, cùng job đang xem, cùng vài lượt trước -> trả lại nguyên kết quả cũ
+    response_key = None
+    if _RESPONSE_CACHE_SIZE > 0:
+        response_key = _response_cache_key(user_message, history, current_job_id, k)
+        hit = _response_cache_get(response_key)
+        if hit is not None:
+            answer_raw, answer_html, context_jobs, query_filters = hit
+            yield {"type": "context", "context_jobs": context_jobs}
+            yield _delta_event(_AnswerHtmlLines(), answer_raw)
+            yield {
+                "type": "done",
+                "answer": answer_html,
+                "context_jobs": context_jobs,
+                "query_filters": query_filters,
+            }
+            return
+
+    # 0. Phân tích câu hỏi để lấy filter có cấu trúc (Gemini, chạy nền)
+    parse_future = _RAG_POOL.submit(parse_user_query, user_message)
+    # request đầu tiên: khởi tạo model trả lời song song với parse + retrieve
+    if _unified_model is None:
+        _RAG_POOL.submit(_warm_unified_model)
+
+    # lấy doc job đang xem song song với parse (DB), thread hiện tại nạp embedding model
+    # và dựng sẵn phần retrieve không phụ thuộc filter
+    # -> thời gian chờ = max(parse, pinned, nạp model) thay vì cộng dồn
+    pinned_future = (
+        _RAG_POOL.submit(fetch_pinned_docs, current_job_id, k)
+        if current_job_id is not None
+        else None
+    )
+    try:
+        get_query_embedding_model()
+    except Exception as e:
+        logger.warning("Không nạp được embedding model: %s", e)
+    retrieval_query = _build_retrieval_query(user_message, history)
 
-    # 0. Phân tích câu hỏi để lấy filter có cấu trúc
     query_filters: Dict[str, Any] = {}
     try:
-        query_filters = parse_user_query(user_message)
+        query_filters = parse_future.result()
     except Exception as e:
         logger.warning("Không phân tích được câu hỏi thành bộ lọc: %s", e)
+    # fetch_pinned_docs tự bắt lỗi DB và trả list rỗng
+    pinned_docs = pinned_future.result() if pinned_future is not None else []
 
     # 1. Retrieve từ vector DB
+    #    Hỏi chi tiết job đang xem -> chỉ cần doc của job đó, bỏ qua embedding + vector search
+    pinned_job_id = None
     try:
-        k = top_k or getattr(settings, "RAG_DEFAULT_TOP_K", 5)
-        retrieval_query = _build_retrieval_query(user_message, history)
-        docs = retrieve_jobs(
-            query=retrieval_query,
-            top_k=k,
-            filters=query_filters,
-            current_job_id=current_job_id,
-        )
+        if (
+            current_job_id is not None
+            and pinned_docs
+            and query_filters.get("intent") == "ask_detail"
+        ):
+            docs = pinned_docs
+            pinned_job_id = current_job_id
+        else:
+            filters_text = retrieval_filters_text(query_filters)
+            query_vec = _reuse_followup_embedding(user_message, history, filters_text)
+            if query_vec is None:
+                query_vec = embed_retrieval_query(retrieval_query, query_filters)
+            _remember_turn_embedding(user_message, history, filters_text, query_vec)
+            docs = retrieve_jobs(
+                query=retrieval_query,
+                top_k=k,
+                filters=query_filters,
+                current_job_id=current_job_id,
+                pinned_docs=pinned_docs,
+                query_vec=query_vec,
+            )
     except Exception as e:
         logger.exception("Lỗi retrieve_jobs: %s", e)
-        return {
-            "answer": (
-                "Hiện tại mình đang gặp lỗi khi tìm kiếm dữ liệu công việc. "
-                "Bạn thử lại sau ít phút nhé."
-            ),
-            "context_jobs": [],
+        yield _chat_error(
+            "Hiện tại mình đang gặp lỗi khi tìm kiếm dữ liệu công việc. "
+            "Bạn thử lại sau ít phút nhé."
+        )
+        return
+
+    # tính sẵn field của từng doc 1 lần, dùng chung cho prompt và context_jobs;
+    # context_jobs không phụ thuộc câu trả lời -> dựng luôn trước khi gọi Gemini
+    jobs = _as_retrieved_jobs(docs)
+    context_jobs = _build_context_jobs(jobs)
+    # gửi danh sách job trước để FE hiển thị gợi ý trong lúc chờ câu trả lời
+    yield {"type": "context", "context_jobs": context_jobs}
+
+    # không có job nào cho câu hỏi về việc làm -> Gemini cũng chỉ nói lại điều này
+    intent = query_filters.get("intent") or "other"
+    if not jobs and intent != "other" and _SHORTCIRCUIT_EMPTY:
+        yield {"type": "delta", "text": _NO_JOBS_TEXT}
+        yield {
+            "type": "done",
+            "answer": _NO_JOBS_HTML,
+            "context_jobs": context_jobs,
+            "query_filters": query_filters,
         }
+        return
 
-    # 2. Gọi Gemini với prompt
+    # 2. Gọi Gemini với prompt (bỏ qua nếu semantic cache có câu gần nghĩa)
     try:
-        answer_raw = generate_answer_unified(user_message, query_filters, docs)
+        answer_raw = None
+        sem_vec = None
+        doc_ids = frozenset(_doc_ids(jobs))
+        sem_scope = _filters_json(query_filters)
+        if _SEMANTIC_CACHE_SIZE > 0 and _answer_cacheable(query_filters):
+            try:
+                sem_vec = np.asarray(embed_query(user_message), dtype=np.float32)
+                answer_raw = _semantic_cache_get(sem_vec, sem_scope, current_job_id, doc_ids)
+            except Exception as e:
+                logger.warning("Semantic cache lỗi, bỏ qua: %s", e)
+                sem_vec = None
+        html_lines = _AnswerHtmlLines()
+        if answer_raw is not None:
+            yield _delta_event(html_lines, answer_raw)
+        else:
+            buf: List[str] = []
+            for piece in stream_answer_unified(
+                user_message, query_filters, jobs, pinned_job_id=pinned_job_id
+            ):
+                buf.append(piece)
+                yield _delta_event(html_lines, piece)
+            answer_raw = "".join(buf).strip()
+            if sem_vec is not None and answer_raw and answer_raw != _NO_ANSWER_TEXT:
+                _semantic_cache_put(
+                    sem_vec, answer_raw, sem_scope, current_job_id, doc_ids
+                )
+        # chỉ clean (escape + link + <br>) khi đã đủ câu trả lời
         answer_text = _clean_answer(answer_raw)
     except Exception as e:
         logger.exception("Lỗi khi gọi Gemini: %s", e)
-        return {
-            "answer": (
-                "Hiện chatbot đang gặp sự cố khi gọi mô hình ngôn ngữ. "
-                "Bạn vui lòng thử lại sau nhé."
-            ),
-            "context_jobs": [],
-        }
+        yield _chat_error(
+            "Hiện chatbot đang gặp sự cố khi gọi mô hình ngôn ngữ. "
+            "Bạn vui lòng thử lại sau nhé."
+        )
+        return
 
     if not answer_text:
         # fallback, cũng convert sang HTML cho thống nhất
-        answer_text = _clean_answer(
-            "Mình chưa nhận được phản hồi rõ ràng từ mô hình. "
-            "Bạn thử hỏi lại một cách cụ thể hơn nhé."
-        )
-
-    # 4. Chuẩn hoá danh sách job để FE dùng (gợi ý job)
-    context_jobs: List[Dict[str, Any]] = []
-    for d in docs:
-        meta = d.get("metadata") or {}
-        salary_text = _format_salary_block(meta)
-        job_id = meta.get("id") or d.get("job_id")
-        app_url = f"/jobs/{job_id}" if job_id is not None else meta.get("url")
-
-        context_jobs.append(
-            {
-                "job_id": job_id,
-                "title": _get_title_upper(meta),
-                "company_name": _get_company_name(meta),
-                "locations": _get_locations_text(meta),
-                "salary_text": salary_text,
-                "url": app_url,
-                "score": d.get("score"),
-            }
-        )
-
-    return {
+        answer_text = _EMPTY_ANSWER_HTML
+    elif (
+        response_key is not None
+        and answer_raw != _NO_ANSWER_TEXT
+        and _answer_cacheable(query_filters)
+    ):
+        _response_cache_put(response_key, answer_raw, answer_text, context_jobs, query_filters)
+
+    yield {
+        "type": "done",
         "answer": answer_text,
         "context_jobs": context_jobs,
         "query_filters": query_filters,
     }
+
+
+# Bản không stream: chạy hết chat_with_rag_stream và trả về event cuối.
+#Trả về:
+#    {
+#      "answer": "<HTML>",       # đã có <br>, <a>...
+#      "context_jobs": [ ... ],  # dùng cho gợi ý job ở UI
+#      "query_filters": { ... }  # phân tích cấu trúc từ câu hỏi người dùng
+#    }
+def chat_with_rag(
+    user_message: str,
+    history: Optional[List[Dict[str, str]]] = None,
+    *,
+    current_job_id: Optional[int] = None,
+    top_k: Optional[int] = None,
+) -> Dict[str, Any]:
+    result: Dict[str, Any] = {}
+    for event in chat_with_rag_stream(
+        user_message, history, current_job_id=current_job_id, top_k=top_k
+    ):
+        if event.get("type") == "done":
+            result = event
+    result = dict(result)
+    result.pop("type", None)
+    return result
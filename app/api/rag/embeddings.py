@@ -3,6 +3,7 @@ import json
 import logging
 import os  
 import re
+import threading
 from datetime import datetime, timezone
 from decimal import Decimal
 from typing import List, Dict, Any, Optional
@@ -12,6 +13,7 @@ from sentence_transformers import SentenceTransformer
 from app.config import settings
 from app.db import get_connection
 from app.api.jobs import SECTION_LABELS  # dùng lại label section từ jobs.py
+from app.api.rag.job_render import render_job_fields
 
 logger = logging.getLogger(__name__)
 
@@ -19,14 +21,21 @@ EMBEDDING_MODEL_NAME = settings.RAG_EMBEDDING_MODEL_NAME
 EMBEDDING_BATCH_SIZE = settings.RAG_EMBEDDING_BATCH_SIZE
 CHUNK_MAX_CHARS = settings.RAG_CHUNK_MAX_CHARS
 
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[\.!?])\s+")
+
 _embedding_model: Optional[SentenceTransformer] = None
+_embedding_model_lock = threading.Lock()
 
 
 def get_embedding_model() -> SentenceTransformer:
     global _embedding_model
-    if _embedding_model is None:
-        logger.info("Loading embedding model: %s", EMBEDDING_MODEL_NAME)
-        _embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+    if _embedding_model is not None:
+        return _embedding_model
+
+    with _embedding_model_lock:
+        if _embedding_model is None:
+            logger.info("Loading embedding model: %s", EMBEDDING_MODEL_NAME)
+            _embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
     return _embedding_model
 
 # Encode list text -> list vector (list[float]), dùng cho cả doc & query.
@@ -311,7 +320,7 @@ def split_text_into_chunks(text: str, max_chars: int = CHUNK_MAX_CHARS) -> List[
 
     if len(clean) <= max_chars:
         return [clean]
-    sentences = re.split(r"(?<=[\.!?])\s+", clean)
+    sentences = _SENTENCE_SPLIT_RE.split(clean)
     chunks: List[str] = []
     current = ""
 
@@ -348,6 +357,8 @@ def upsert_rag_doc_for_job(job_id: int) -> int:
             sections_raw = _fetch_job_sections_raw(cur, job_id)
 
             job_meta = build_job_meta(job_row, locations)
+            # render sẵn header/lương/địa điểm cho prompt chat (chat_logic.RetrievedJob)
+            job_meta["rendered"] = render_job_fields(_to_jsonable(job_meta))
 
             # Xoá toàn bộ doc cũ của job này để insert lại sạch sẽ
             cur.execute(
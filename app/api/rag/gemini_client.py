@@ -0,0 +1,52 @@
+# app/api/rag/gemini_client.py
+
+from __future__ import annotations
+
+import logging
+import threading
+
+import google.generativeai as genai
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+_configured = False
+_configure_lock = threading.Lock()
+
+
+def configure_gemini() -> None:
+    """
+    genai.configure là state global của SDK -> chỉ gọi 1 lần cho cả process,
+    dùng chung cho model trả lời (chat_logic) và model parse câu hỏi (query_parser).
+    """
+    global _configured
+    if _configured:
+        return
+    with _configure_lock:
+        if _configured:
+            return
+        api_key = getattr(settings, "GEMINI_API_KEY", "") or ""
+        if not api_key:
+            raise RuntimeError("GEMINI_API_KEY chưa được cấu hình.")
+        # grpc: 1 channel HTTP/2 giữ kết nối, dùng lại cho mọi generate_content
+        # (không mở TLS mới mỗi lần gọi); "rest" nếu mạng chặn gRPC
+        genai.configure(api_key=api_key, transport=settings.GEMINI_TRANSPORT)
+        _configured = True
+
+
+def warm_gemini_connection() -> None:
+    """
+    Gọi 1 RPC nhẹ (count_tokens, không tốn quota sinh) để SDK tạo client + channel gRPC
+    và bắt tay TLS trước request chat đầu tiên. count_tokens đi qua cùng client với
+    generate_content (get_model thì dùng client model-service, channel riêng), nên channel
+    được warm chính là channel mọi lần parse / trả lời dùng về sau.
+    Chưa có API key / lỗi mạng -> chỉ log, không ảnh hưởng app.
+    """
+    if not getattr(settings, "GEMINI_API_KEY", ""):
+        return
+    try:
+        configure_gemini()
+        genai.GenerativeModel(settings.GEMINI_MODEL).count_tokens("ping")
+    except Exception as e:
+        logger.warning("Không warm-up được kết nối Gemini: %s", e)
@@ -0,0 +1,144 @@
+# app/api/rag/job_render.py
+
+from __future__ import annotations
+
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+# Render các field hiển thị của 1 job từ metadata (header, lương, địa điểm, kinh nghiệm).
+# Dùng chung cho lúc index (embeddings) và lúc chat (chat_logic), không kéo theo
+# Gemini / thread pool / cache của phần chat.
+
+# thay cho `x.get(...) or {}` trên metadata: không tạo dict rỗng mới mỗi lần gọi.
+# Chỉ để đọc, không được sửa.
+_EMPTY_DICT: Dict[str, Any] = {}
+
+
+# format lương
+def _format_salary_block(meta: Dict[str, Any]) -> str:
+    salary = meta.get("salary") or _EMPTY_DICT
+    raw_text = salary.get("raw_text")
+    if raw_text:
+        return raw_text
+    return _format_salary_cached(
+        _salary_amount(salary.get("min")),
+        _salary_amount(salary.get("max")),
+        salary.get("currency") or "VND",
+        salary.get("interval") or "MONTH",
+    )
+
+
+# lương luôn là số nguyên -> làm tròn 1 lần, format bằng "{:,}" thay vì qua float ",.0f"
+def _salary_amount(value: Any) -> Optional[int]:
+    if value is None:
+        return None
+    if isinstance(value, int):
+        return value
+    return int(round(value))
+
+
+_INTERVAL_VI = {
+    "MONTH": "/tháng",
+    "YEAR": "/năm",
+    "HOUR": "/giờ",
+}
+
+
+# cache theo bộ giá trị lương (ít giá trị khác nhau, job lặp lại giữa các câu hỏi)
+@lru_cache(maxsize=4096)
+def _format_salary_cached(
+    salary_min: Optional[int], salary_max: Optional[int], currency: str, interval: str
+) -> str:
+    interval_vi = _INTERVAL_VI.get(interval, "")
+
+    if salary_min is None and salary_max is None:
+        return "Thoả thuận"
+
+    if salary_min is not None and salary_max is not None:
+        return f"Từ {salary_min:,} đến {salary_max:,} {currency} {interval_vi}"
+
+    if salary_min is not None:
+        return f"Từ {salary_min:,} {currency} {interval_vi}"
+
+    return f"Đến {salary_max:,} {currency} {interval_vi}"
+
+
+def _get_company_name(meta: Dict[str, Any]) -> str:
+    company = meta.get("company")
+    if isinstance(company, dict):
+        return company.get("name") or ""
+    if isinstance(company, str):
+        return company
+    return ""
+
+
+def _get_locations_text(meta: Dict[str, Any]) -> str:
+    locs = meta.get("locations")
+    if not locs:
+        return ""
+    if isinstance(locs, list):
+        return ", ".join([str(x) for x in locs if x])
+    return str(locs)
+
+# metadata(kinh nghiệm) -> thành chuỗi dễ đọc
+def _format_experience_block(meta: Dict[str, Any]) -> str:
+    experience = meta.get("experience") or _EMPTY_DICT
+    months = experience.get("months")
+    raw_text = experience.get("raw_text") or meta.get("experience_raw_text")
+
+    if raw_text:
+        return raw_text
+    if months is None:
+        return ""
+    if months <= 0:
+        return "Không yêu cầu kinh nghiệm"
+    years = months // 12
+    remaining_months = months % 12
+    if years and remaining_months:
+        return f"Tối thiểu {years} năm {remaining_months} tháng kinh nghiệm"
+    if years:
+        return f"Tối thiểu {years} năm kinh nghiệm"
+    return f"Tối thiểu {months} tháng kinh nghiệm"
+
+_SALARY_LABEL = "lương: "
+_LOCATION_LABEL = "địa điểm: "
+_EXPERIENCE_LABEL = "kinh nghiệm: "
+# tăng khi đổi cách render -> snippet cũ trong metadata bị bỏ qua, render lại lúc chat
+_CONTEXT_RENDER_VERSION = 1
+
+
+def render_job_fields(meta: Dict[str, Any], job_id: Any = None) -> Dict[str, Any]:
+    """
+    Render sẵn các field hiển thị của 1 job (header context, lương, địa điểm...).
+    Dùng lúc index (lưu vào metadata["rendered"]) và làm fallback lúc chat.
+    """
+    if job_id is None:
+        job_id = meta.get("id")
+    title = meta.get("title") or ""
+    company_name = _get_company_name(meta)
+    salary_text = _format_salary_block(meta)
+    locations_text = _get_locations_text(meta)
+    experience_text = _format_experience_block(meta)
+
+    details: List[str] = []
+    if salary_text:
+        details.append(_SALARY_LABEL + salary_text)
+    if locations_text:
+        details.append(_LOCATION_LABEL + locations_text)
+    if experience_text:
+        details.append(_EXPERIENCE_LABEL + experience_text)
+
+    header = "".join(
+        ("[JOB ", str(job_id), "] ", str(title), " – ", company_name)
+    ).strip()
+    if details:
+        header = "".join((header, " (", "; ".join(details), ")"))
+
+    return {
+        "version": _CONTEXT_RENDER_VERSION,
+        "header": header,
+        "company_name": company_name,
+        "salary_text": salary_text,
+        "locations_text": locations_text,
+        "experience_text": experience_text,
+    }
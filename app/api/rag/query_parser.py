@@ -4,13 +4,26 @@ from __future__ import annotations
 
 import json
 import logging
-from typing import Any, Dict, List, Optional
+import threading
+from concurrent.futures import Future
+from typing import Any, Dict, Optional, Tuple
 
 import google.generativeai as genai
+from app.cache import TTLCache
 from app.config import settings
+from app.api.rag.gemini_client import configure_gemini
 
 logger = logging.getLogger(__name__)
 _parser_model: Optional[genai.GenerativeModel] = None
+_parser_model_lock = threading.Lock()
+
+# cache kết quả parse theo câu hỏi đã chuẩn hoá (lower + gộp khoảng trắng)
+_PARSE_CACHE_SIZE = 2048
+_parse_cache = TTLCache(_PARSE_CACHE_SIZE)
+# câu hỏi đang được parse: request trùng câu hỏi chờ kết quả thay vì gọi Gemini lần nữa.
+# Tra cache + đăng ký inflight trong cùng 1 lock để không có 2 leader cho 1 câu hỏi
+_parse_inflight_lock = threading.Lock()
+_parse_inflight: Dict[str, "Future[Tuple[Dict[str, Any], bool]]"] = {}
 
 # gọi model
 def _get_parser_model() -> genai.GenerativeModel:
@@ -18,17 +31,17 @@ def _get_parser_model() -> genai.GenerativeModel:
     if _parser_model is not None:
         return _parser_model
 
-    api_key = getattr(settings, "GEMINI_API_KEY", "") or ""
-    if not api_key:
-        raise RuntimeError("GEMINI_API_KEY chưa được cấu hình.")
-    model_name = (
-        getattr(settings, "GEMINI_QUERY_MODEL", "") or "gemini-2.0-flash"
-    )
+    with _parser_model_lock:
+        if _parser_model is not None:
+            return _parser_model
 
-    genai.configure(api_key=api_key)
-    _parser_model = genai.GenerativeModel(model_name)
-    logger.info("Query parser model initialized: %s", model_name)
-    return _parser_model
+        configure_gemini()
+        model_name = (
+            getattr(settings, "GEMINI_QUERY_MODEL", "") or "gemini-2.0-flash"
+        )
+        _parser_model = genai.GenerativeModel(model_name)
+        logger.info("Query parser model initialized: %s", model_name)
+        return _parser_model
 
 def _default_filters() -> Dict[str, Any]:
     return {
@@ -41,20 +54,52 @@ def _default_filters() -> Dict[str, Any]:
     }
 
 
+def _copy_filters(filters: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: (list(v) if isinstance(v, list) else v) for k, v in filters.items()}
+
+
 def parse_user_query(user_message: str) -> Dict[str, Any]:
     """
     Dùng Gemini để bóc tách câu hỏi thành filter có cấu trúc.
     Luôn trả về dict với đủ key (có thể None / [] nếu không suy ra được).
+    Kết quả parse thành công được cache theo câu hỏi đã chuẩn hoá;
+    các request cùng câu hỏi đến cùng lúc dùng chung 1 lần gọi Gemini.
     """
-    base = _default_filters()
     msg = (user_message or "").strip()
     if not msg:
-        return base
-
+        return _default_filters()
+
+    key = " ".join(msg.lower().split())
+    with _parse_inflight_lock:
+        cached = _parse_cache.get(key)
+        if cached is not None:
+            return _copy_filters(cached)
+        inflight = _parse_inflight.get(key)
+        if inflight is None:
+            inflight = Future()
+            _parse_inflight[key] = inflight
+            leader = True
+        else:
+            leader = False
+
+    if not leader:
+        result, _ = inflight.result()
+        return _copy_filters(result)
+
+    result, ok = _default_filters(), False
     try:
-        model = _get_parser_model()
-
-        prompt = f"""
+        result, ok = _parse_user_query_uncached(msg)
+    finally:
+        with _parse_inflight_lock:
+            if ok:
+                _parse_cache.put(key, _copy_filters(result))
+            del _parse_inflight[key]
+        inflight.set_result((_copy_filters(result), ok))
+    return result
+
+
+# Phần cố định của prompt parse, dựng 1 lần lúc import; chỉ ghép thêm câu hỏi mỗi lần gọi
+_PARSE_PROMPT_HEAD = """
 Bạn là module phân tích câu hỏi tuyển dụng, nhiệm vụ là TRẢ VỀ JSON DUY NHẤT.
 
 Hãy đọc câu hỏi của người dùng (tiếng Việt) và trích xuất các trường sau:
@@ -81,57 +126,44 @@ Yêu cầu:
 - Chỉ TRẢ VỀ JSON THUẦN, KHÔNG giải thích thêm.
 
 Câu hỏi người dùng:
-\"\"\"{msg}\"\"\" 
-"""
+\"\"\""""
+_PARSE_PROMPT_TAIL = '""" \n'
+
+_PARSE_GENERATION_CONFIG = {
+    "temperature": 0.0,
+    "top_p": 0.9,
+    "top_k": 32,
+    "max_output_tokens": 128,
+    # ⚠️ Quan trọng: ép model trả về application/json
+    "response_mime_type": "application/json",
+}
+
+
+# Trả về (filters, ok); ok = False khi model lỗi / không đọc được JSON (không cache)
+def _parse_user_query_uncached(msg: str) -> Tuple[Dict[str, Any], bool]:
+    base = _default_filters()
+    try:
+        model = _get_parser_model()
+
+        prompt = "".join((_PARSE_PROMPT_HEAD, msg, _PARSE_PROMPT_TAIL))
 
-        # ⚠️ Quan trọng: ép model trả về application/json
         resp = model.generate_content(
             prompt,
-            generation_config={
-                "temperature": 0.0,
-                "top_p": 0.9,
-                "top_k": 32,
-                "max_output_tokens": 128,
-                "response_mime_type": "application/json",
-            },
+            generation_config=_PARSE_GENERATION_CONFIG,
         )
 
-        text = ""
-
-        # Ưu tiên lấy từ candidates[0].content.parts[*].text
+        # .text đã ghép sẵn candidates[0].content.parts, ValueError nếu không có part
         try:
-            candidates = getattr(resp, "candidates", None) or []
-            if candidates:
-                cand = candidates[0]
-                content = getattr(cand, "content", None)
-                parts = getattr(content, "parts", None) if content is not None else None
-                if parts:
-                    buf: List[str] = []
-                    for p in parts:
-                        t = getattr(p, "text", None)
-                        if t:
-                            buf.append(t)
-                    text = "".join(buf).strip()
-
-            # fallback sang resp.text nếu trên không lấy được
-            if not text:
-                raw = getattr(resp, "text", None)
-                if raw:
-                    text = raw.strip()
-        except Exception as e:
-            logger.warning(
-                "parse_user_query: lỗi khi đọc candidates, fallback resp.text: %s",
-                e,
-            )
-            raw = getattr(resp, "text", None)
-            if raw:
-                text = raw.strip()
+            text = (resp.text or "").strip()
+        except ValueError as e:
+            logger.warning("parse_user_query: response không có text: %s", e)
+            text = ""
 
         if not text:
             logger.warning(
                 "parse_user_query: model không trả về text (finish_reason có thể là MAX_TOKENS)."
             )
-            return base
+            return base, False
 
         # Vì đã ép response_mime_type=application/json,
         # thông thường text chính là JSON thuần, nhưng vẫn để phòng hờ.
@@ -142,7 +174,7 @@ Câu hỏi người dùng:
                 "parse_user_query: không tìm thấy JSON trong đáp án: %r",
                 text[:200],
             )
-            return base
+            return base, False
 
         json_str = text[start : end + 1]
         data = json.loads(json_str)
@@ -152,8 +184,8 @@ Câu hỏi người dùng:
         for k in result.keys():
             if k in data:
                 result[k] = data.get(k)
-        return result
+        return result, True
 
     except Exception as e:
         logger.exception("parse_user_query lỗi: %s", e)
-        return base
+        return base, False
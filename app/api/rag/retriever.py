@@ -1,9 +1,14 @@
 from __future__ import annotations
 import json
 import logging
-from typing import Any, Dict, List, Optional
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
 from datetime import datetime, timezone
 from sentence_transformers import SentenceTransformer
+from app.cache import TTLCache
 from app.db import get_connection
 from app.config import settings
 
@@ -11,31 +16,118 @@ logger = logging.getLogger(__name__)
 
 #  EMBEDDING MODEL
 _embedding_model: Optional[SentenceTransformer] = None
+_embedding_model_lock = threading.Lock()
+
+# text truy vấn (đã gộp khoảng trắng) -> embedding; câu hỏi phổ biến lặp lại nhiều
+_query_embeddings = TTLCache(settings.RAG_QUERY_EMBEDDING_CACHE_SIZE)
+
+# gom các câu cần embed từ nhiều request đồng thời thành 1 lần model.encode
+# (1 thread worker; không có request khác đang chờ thì encode ngay, không đợi thêm)
+_embed_queue: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+_embed_worker: Optional[threading.Thread] = None
+_embed_worker_lock = threading.Lock()
+
+# (job_id, limit) -> docs; hỏi nhiều lượt về cùng 1 job đang xem
+_pinned_docs_cache = TTLCache(
+    settings.RAG_PINNED_DOCS_CACHE_SIZE, settings.RAG_PINNED_DOCS_CACHE_TTL_SECONDS
+)
 
 #  Model dùng cho query (phải trùng với model lúc index).
 def get_query_embedding_model() -> SentenceTransformer:
     global _embedding_model
-    if _embedding_model is None:
-        logger.info(
-            "Loading query embedding model: %s",
-            settings.RAG_EMBEDDING_MODEL_NAME,
-        )
-        model = SentenceTransformer(settings.RAG_EMBEDDING_MODEL_NAME)
-        # hạn chế độ dài cho chắc
-        model.max_seq_length = 512
-        _embedding_model = model
+    if _embedding_model is not None:
+        return _embedding_model
+
+    # nhiều request đầu tiên cùng lúc -> chỉ 1 thread nạp model
+    with _embedding_model_lock:
+        if _embedding_model is None:
+            logger.info(
+                "Loading query embedding model: %s",
+                settings.RAG_EMBEDDING_MODEL_NAME,
+            )
+            model = SentenceTransformer(settings.RAG_EMBEDDING_MODEL_NAME)
+            # hạn chế độ dài cho chắc
+            model.max_seq_length = 512
+            _embedding_model = model
     return _embedding_model
 
 def embed_query(text: str) -> List[float]:
-    model = get_query_embedding_model()
-    vec = model.encode(text, show_progress_bar=False, normalize_embeddings=True)
-    return vec.tolist()
+    # chỉ gộp khoảng trắng, không lower: model embedding có thể phân biệt hoa/thường
+    key = " ".join((text or "").split())
+    vec = _query_embeddings.get(key)
+    if vec is not None:
+        return list(vec)
+
+    if settings.RAG_EMBED_BATCH_MAX > 1:
+        fut: Future = Future()
+        _ensure_embed_worker()
+        _embed_queue.put((key, fut))
+        vec = fut.result()
+    else:
+        model = get_query_embedding_model()
+        vec = model.encode(key, show_progress_bar=False, normalize_embeddings=True).tolist()
+
+    _query_embeddings.put(key, vec)
+    return list(vec)
+
+def _ensure_embed_worker() -> None:
+    global _embed_worker
+    if _embed_worker is not None:
+        return
+    with _embed_worker_lock:
+        if _embed_worker is None:
+            _embed_worker = threading.Thread(
+                target=_embed_worker_loop, name="rag-embed", daemon=True
+            )
+            _embed_worker.start()
+
+
+# Lấy 1 câu (chờ), rồi vét thêm các câu đang xếp hàng (tối đa RAG_EMBED_BATCH_MAX,
+# chờ thêm tối đa RAG_EMBED_BATCH_WAIT_MS) và encode chung 1 batch
+def _embed_worker_loop() -> None:
+    max_batch = settings.RAG_EMBED_BATCH_MAX
+    wait_s = settings.RAG_EMBED_BATCH_WAIT_MS / 1000.0
+    while True:
+        batch = [_embed_queue.get()]
+        deadline = time.monotonic() + wait_s
+        while len(batch) < max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(_embed_queue.get(timeout=remaining))
+                else:
+                    batch.append(_embed_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        try:
+            model = get_query_embedding_model()
+            vecs = model.encode(
+                texts,
+                batch_size=len(texts),
+                show_progress_bar=False,
+                normalize_embeddings=True,
+            ).tolist()
+        except Exception as e:
+            for _, fut in batch:
+                fut.set_exception(e)
+            continue
+        by_text = dict(zip(texts, vecs))
+        for text, fut in batch:
+            fut.set_result(by_text[text])
+
 
 #  FILTER HELPERS
 
 def _normalize_text(s: str) -> str:
     return (s or "").strip().lower()
 
+
+# chuẩn hoá list từ khoá filter 1 lần cho cả lượt retrieve (bỏ phần tử rỗng)
+def _normalized_terms(values: List[str]) -> List[str]:
+    return [t for t in (_normalize_text(v) for v in values) if t]
+
 #     Ghép thêm từ khoá / địa điểm đã parse vào câu truy vấn để tăng độ khớp embedding.
 def _augment_query_with_filters(query: str, filters: Dict[str, Any]) -> str:
     query = (query or "").strip()
@@ -63,22 +155,21 @@ def _augment_query_with_filters(query: str, filters: Dict[str, Any]) -> str:
     return " | ".join(parts)
 
 # Lọc theo địa điểm:
-#    - Nếu không có filter_locations -> luôn pass
+#    - Nếu không có location_terms -> luôn pass
 #    - Nếu có -> check trong meta["locations"] và text.
+#    - location_terms / text_norm đã qua _normalize_text
 def _location_pass(
     meta: Dict[str, Any],
-    filter_locations: List[str],
-    chunk_text: str,
+    location_terms: List[str],
+    text_norm: str,
 ) -> bool:
-    if not filter_locations:
+    if not location_terms:
         return True
 
     meta_locs: List[str] = meta.get("locations") or []
     meta_locs_norm = " ".join(_normalize_text(x) for x in meta_locs)
-    text_norm = _normalize_text(chunk_text)
-    for loc in filter_locations:
-        loc_norm = _normalize_text(loc)
-        if loc_norm and (loc_norm in meta_locs_norm or loc_norm in text_norm):
+    for loc_norm in location_terms:
+        if loc_norm in meta_locs_norm or loc_norm in text_norm:
             return True
     return False
 
@@ -118,10 +209,10 @@ def _salary_pass(
 # Lọc theo kỹ năng: check trong mô tả / yêu cầu / chunk_text.
 def _skills_pass(
     meta: Dict[str, Any],
-    filter_skills: List[str],
-    chunk_text: str,
+    skill_terms: List[str],
+    text_norm: str,
 ) -> bool:
-    if not filter_skills:
+    if not skill_terms:
         return True
 
     detail_sections = meta.get("detail_sections") or {}
@@ -132,19 +223,18 @@ def _skills_pass(
         [
             _normalize_text(mo_ta),
             _normalize_text(yeu_cau),
-            _normalize_text(chunk_text),
+            text_norm,
         ]
     )
 
-    for skill in filter_skills:
-        s_norm = _normalize_text(skill)
-        if s_norm and s_norm in haystack:
+    for s_norm in skill_terms:
+        if s_norm in haystack:
             return True
     return False
 
 # Lọc theo chức danh / từ khoá nghề nghiệp để tránh drift sang ngành khác.
-def _keyword_pass(meta: Dict[str, Any], job_keywords: List[str], chunk_text: str) -> bool:
-    if not job_keywords:
+def _keyword_pass(meta: Dict[str, Any], keyword_terms: List[str], text_norm: str) -> bool:
+    if not keyword_terms:
         return True
 
     title = _normalize_text(meta.get("title"))
@@ -153,13 +243,12 @@ def _keyword_pass(meta: Dict[str, Any], job_keywords: List[str], chunk_text: str
         [
             title,
             company,
-            _normalize_text(chunk_text),
+            text_norm,
         ]
     )
 
-    for kw in job_keywords:
-        k_norm = _normalize_text(kw)
-        if k_norm and k_norm in haystack:
+    for k_norm in keyword_terms:
+        if k_norm in haystack:
             return True
     return False
 
@@ -246,6 +335,7 @@ def fetch_full_job_detail(job_id: int) -> Optional[Dict[str, Any]]:
             j.so_luong_tuyen,
             j.so_luong_tuyen_raw,
             j.deadline,
+            j.crawled_at,
             c.name AS company_name,
             c.url AS company_url
         FROM jobs j
@@ -314,6 +404,7 @@ def fetch_full_job_detail(job_id: int) -> Optional[Dict[str, Any]]:
             "deadline": row.get("deadline"),
         },
         "detail_sections": detail_sections,
+        "crawled_at": row.get("crawled_at"),
     }
 
     return {
@@ -326,6 +417,37 @@ def fetch_full_job_detail(job_id: int) -> Optional[Dict[str, Any]]:
     }
 
 
+# Embedding dùng cho vector search (query đã ghép filter), giống bước 1 của retrieve_jobs
+def embed_retrieval_query(query: str, filters: Optional[Dict[str, Any]] = None) -> List[float]:
+    return embed_query(_augment_query_with_filters((query or "").strip(), filters or {}))
+
+
+# Phần filter được ghép vào query khi embedding (rỗng nếu không có filter nào)
+def retrieval_filters_text(filters: Optional[Dict[str, Any]] = None) -> str:
+    return _augment_query_with_filters("", filters or {})
+
+
+# Doc của job đang xem để ghim lên đầu kết quả (lỗi -> list rỗng), cache ngắn theo job
+def fetch_pinned_docs(current_job_id: Optional[int], top_k: Optional[int] = None) -> List[Dict[str, Any]]:
+    if not current_job_id:
+        return []
+    top_k = top_k or settings.RAG_DEFAULT_TOP_K
+    limit = max(6, top_k or 0)
+    key = (current_job_id, limit)
+    hit = _pinned_docs_cache.get(key)
+    if hit is not None:
+        return list(hit)
+
+    try:
+        docs = _fetch_job_docs(current_job_id, limit=limit)
+    except Exception as e:
+        logger.warning("Không lấy được doc cho job hiện tại %s: %s", current_job_id, e)
+        return []
+
+    _pinned_docs_cache.put(key, docs)
+    return list(docs)
+
+
 def retrieve_jobs(
     query: str,
     top_k: Optional[int] = None,
@@ -333,10 +455,14 @@ def retrieve_jobs(
     filters: Optional[Dict[str, Any]] = None,
     *,
     current_job_id: Optional[int] = None,
+    pinned_docs: Optional[List[Dict[str, Any]]] = None,
+    query_vec: Optional[List[float]] = None,
 ) -> List[Dict[str, Any]]:
     """
     Truy vấn rag_job_documents theo embedding + lọc hybrid (địa điểm, lương, kỹ năng),
     đồng thời ghim job hiện tại (nếu truyền current_job_id).
+    pinned_docs: doc của job hiện tại đã lấy sẵn (bỏ qua bước _fetch_job_docs).
+    query_vec: embedding đã tính sẵn (bỏ qua bước embed_retrieval_query).
 
     Trả về list doc dạng:
     {
@@ -359,17 +485,13 @@ def retrieve_jobs(
     f_max_salary: Optional[int] = filters.get("max_salary_vnd")
     f_skills: List[str] = filters.get("skills") or []
     f_job_keywords: List[str] = filters.get("job_keywords") or []
-    pinned_docs: List[Dict[str, Any]] = []
-
-    if current_job_id:
-        try:
-            pinned_docs = _fetch_job_docs(current_job_id, limit=max(6, top_k or 0))
-        except Exception as e:
-            logger.warning("Không lấy được doc cho job hiện tại %s: %s", current_job_id, e)
+    if pinned_docs is None:
+        pinned_docs = fetch_pinned_docs(current_job_id, top_k)
 
     #  1. embedding cho query 
     augmented_query = _augment_query_with_filters(query, filters)
-    query_vec = embed_query(augmented_query)
+    if query_vec is None:
+        query_vec = embed_query(augmented_query)
 
     # Lấy pool lớn hơn top_k để còn lọc
     candidate_k = max(top_k * 5, 30)
@@ -442,18 +564,22 @@ def retrieve_jobs(
     )
 
     #  2. Lọc theo filters (hybrid) 
+    #     chuẩn hoá filter 1 lần / lượt, chunk_text 1 lần / doc
+    location_terms = _normalized_terms(f_locations)
+    skill_terms = _normalized_terms(f_skills)
+    keyword_terms = _normalized_terms(f_job_keywords)
     filtered: List[Dict[str, Any]] = []
     for d in raw_results:
         meta = d.get("metadata") or {}
-        chunk_text = d.get("chunk_text") or ""
+        text_norm = _normalize_text(d.get("chunk_text") or "")
 
-        if not _location_pass(meta, f_locations, chunk_text):
+        if not _location_pass(meta, location_terms, text_norm):
             continue
         if not _salary_pass(meta, f_min_salary, f_max_salary):
             continue
-        if not _skills_pass(meta, f_skills, chunk_text):
+        if not _skills_pass(meta, skill_terms, text_norm):
             continue
-        if not _keyword_pass(meta, f_job_keywords, chunk_text):
+        if not _keyword_pass(meta, keyword_terms, text_norm):
             continue
 
         filtered.append(d)
@@ -1,3 +1,4 @@
+from functools import lru_cache
 from typing import Optional, Union
 
 Number = Optional[Union[int, float]]
@@ -39,18 +40,33 @@ def format_salary_text(
     if raw_text:
         return str(raw_text)
 
-    min_v = _to_number(salary_min)
-    max_v = _to_number(salary_max)
+    return _format_salary_cached(
+        _to_number(salary_min),
+        _to_number(salary_max),
+        (currency or "VND").upper(),
+        (interval or "").upper(),
+    )
 
+
+_INTERVAL_VI = {
+    "MONTH": "/tháng",
+    "YEAR": "/năm",
+    "HOUR": "/giờ",
+}
+
+
+# Trang danh sách / bookmark gọi cho từng job, các mức lương lặp lại rất nhiều
+@lru_cache(maxsize=4096)
+def _format_salary_cached(
+    min_v: Optional[float],
+    max_v: Optional[float],
+    cur: str,
+    interval: str,
+) -> str:
     if min_v is None and max_v is None:
         return "Thoả thuận"
 
-    cur = (currency or "VND").upper()
-    interval_vi = {
-        "MONTH": "/tháng",
-        "YEAR": "/năm",
-        "HOUR": "/giờ",
-    }.get((interval or "").upper(), "")
+    interval_vi = _INTERVAL_VI.get(interval, "")
     suffix = f" {interval_vi}" if interval_vi else ""
 
     def fmt(value: Optional[float]) -> Optional[str]:
@@ -58,7 +74,8 @@ def format_salary_text(
             return None
         if cur == "VND":
             return _format_amount_vnd(value)
-        return f"{value:,.0f} {cur}"
+        # số nguyên có phân cách nghìn, không qua format float ",.0f"
+        return f"{int(round(value)):,} {cur}"
 
     if min_v is not None and max_v is not None:
         return f"Từ {fmt(min_v)} đến {fmt(max_v)}{suffix}"
@@ -1,10 +1,31 @@
 # app/api/server.py
 import os
+import threading
+
+import orjson
 from flask import Flask
+from flask.json.provider import DefaultJSONProvider
 
 from app.api.jobs import jobs_bp
 from app.api.auth import auth_bp
 from app.api.chat import chat_bp
+from app.api.rag.gemini_client import warm_gemini_connection
+from app.config import settings
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider dùng orjson cho jsonify / request.get_json."""
+
+    def dumps(self, obj, **kwargs) -> str:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_NAIVE_UTC
+        if kwargs.get("indent"):
+            option |= orjson.OPT_INDENT_2
+        if kwargs.get("sort_keys"):
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 
 def create_app() -> Flask:
@@ -19,6 +40,8 @@ def create_app() -> Flask:
         static_folder=static_dir,
     )
 
+    app.json = OrjsonProvider(app)
+
     # Secret key cho session (sẽ đọc từ .env)
     app.config["SECRET_KEY"] = os.getenv("SECRET_KEY", "dev-secret")
 
@@ -27,4 +50,10 @@ def create_app() -> Flask:
     app.register_blueprint(auth_bp)
     app.register_blueprint(chat_bp)
 
+    # chạy nền, không chặn app khởi động
+    if settings.GEMINI_WARMUP_ON_START:
+        threading.Thread(
+            target=warm_gemini_connection, name="gemini-warmup", daemon=True
+        ).start()
+
     return app
@@ -16,6 +16,18 @@ class Settings:
     POSTGRES_DB = os.getenv("POSTGRES_DB", "topcv_db")
     POSTGRES_HOST = os.getenv("POSTGRES_HOST", "localhost")
     POSTGRES_PORT = int(os.getenv("POSTGRES_PORT", "5440"))
+    POSTGRES_POOL_MIN: int = int(os.getenv("POSTGRES_POOL_MIN", "4"))
+    POSTGRES_POOL_MAX: int = int(os.getenv("POSTGRES_POOL_MAX", "32"))
+    # pool hết connection -> chờ tối đa N giây rồi mới báo lỗi
+    POSTGRES_POOL_TIMEOUT_SECONDS: float = float(os.getenv("POSTGRES_POOL_TIMEOUT_SECONDS", "30"))
+
+    # auth - app/api/auth.py
+    USE_VERIFY_PASSWORD_CACHE: bool = (
+        os.getenv("USE_VERIFY_PASSWORD_CACHE", "false").lower() == "true"
+    )
+    VERIFY_PASSWORD_CACHE_SIZE: int = int(os.getenv("VERIFY_PASSWORD_CACHE_SIZE", "4096"))
+    # 0 = theo số CPU
+    PASSWORD_HASH_WORKERS: int = int(os.getenv("PASSWORD_HASH_WORKERS", "0"))
 
     # crawl - app/topcv
     TOPCV_SITEMAP_ROOT: str = os.getenv(
@@ -45,7 +57,35 @@ class Settings:
     RAG_CHUNK_MAX_CHARS: int = int(os.getenv("RAG_CHUNK_MAX_CHARS", "800"))
     RAG_DEFAULT_TOP_K: int = int(os.getenv("RAG_DEFAULT_TOP_K", "8"))
     RAG_MAX_CONTEXT_DOCS: int = int(os.getenv("RAG_MAX_CONTEXT_DOCS", "20"))
+    # tổng ký tự context job đưa vào prompt trả lời (proxy cho số token)
+    RAG_MAX_CONTEXT_CHARS: int = int(os.getenv("RAG_MAX_CONTEXT_CHARS", "12000"))
     RAG_MAX_HISTORY_TURNS: int = int(os.getenv("RAG_MAX_HISTORY_TURNS", "10"))
+    # số ký tự tối đa mỗi mục chi tiết / mỗi chunk khi đưa vào prompt (0 = không cắt)
+    RAG_SECTION_CHAR_BUDGET: int = int(os.getenv("RAG_SECTION_CHAR_BUDGET", "1200"))
+    RAG_CHUNK_CHAR_BUDGET: int = int(os.getenv("RAG_CHUNK_CHAR_BUDGET", "800"))
+    # đưa nội dung chunk retrieve vào prompt (false = chỉ header + section chi tiết nếu có)
+    RAG_INCLUDE_CHUNK_TEXT: bool = (
+        os.getenv("RAG_INCLUDE_CHUNK_TEXT", "true").lower() == "true"
+    )
+    # cache embedding câu truy vấn theo text đã chuẩn hoá khoảng trắng (0 = tắt)
+    RAG_QUERY_EMBEDDING_CACHE_SIZE: int = int(
+        os.getenv("RAG_QUERY_EMBEDDING_CACHE_SIZE", "1024")
+    )
+    # gom embed câu truy vấn của các request đồng thời thành 1 batch (<= 1 = tắt);
+    # WAIT_MS: chờ thêm để gom (0 = chỉ gom các câu đang xếp hàng sẵn)
+    RAG_EMBED_BATCH_MAX: int = int(os.getenv("RAG_EMBED_BATCH_MAX", "16"))
+    RAG_EMBED_BATCH_WAIT_MS: int = int(os.getenv("RAG_EMBED_BATCH_WAIT_MS", "0"))
+    # cache doc của job đang xem giữa các lượt hỏi (0 = tắt)
+    RAG_PINNED_DOCS_CACHE_SIZE: int = int(os.getenv("RAG_PINNED_DOCS_CACHE_SIZE", "256"))
+    RAG_PINNED_DOCS_CACHE_TTL_SECONDS: int = int(
+        os.getenv("RAG_PINNED_DOCS_CACHE_TTL_SECONDS", "60")
+    )
+    # câu hỏi về việc làm nhưng không retrieve được job nào -> trả lời sẵn, không gọi Gemini
+    RAG_SHORTCIRCUIT_EMPTY: bool = (
+        os.getenv("RAG_SHORTCIRCUIT_EMPTY", "true").lower() == "true"
+    )
+    # câu chỉ có lời chào / hỏi chatbot là ai -> trả lời mẫu, không parse / retrieve / Gemini
+    RAG_QUICK_REPLY: bool = os.getenv("RAG_QUICK_REPLY", "true").lower() == "true"
 
     GEMINI_API_KEY: str = os.getenv("GEMINI_API_KEY", "")
     GEMINI_MODEL: str = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
@@ -53,5 +93,37 @@ class Settings:
     GEMINI_MAX_OUTPUT_TOKENS: int = int(
         os.getenv("GEMINI_MAX_OUTPUT_TOKENS", "2048")
     )
+    GEMINI_TRANSPORT: str = os.getenv("GEMINI_TRANSPORT", "grpc")
+    # mở sẵn kết nối tới Gemini lúc khởi động app (request chat đầu không phải chờ TLS)
+    GEMINI_WARMUP_ON_START: bool = (
+        os.getenv("GEMINI_WARMUP_ON_START", "true").lower() == "true"
+    )
+    # Gemini context caching cho phần prompt cố định
+    GEMINI_CONTEXT_CACHE: bool = os.getenv("GEMINI_CONTEXT_CACHE", "false").lower() == "true"
+    GEMINI_CONTEXT_CACHE_TTL_SECONDS: int = int(
+        os.getenv("GEMINI_CONTEXT_CACHE_TTL_SECONDS", "3600")
+    )
+    # CachedContent riêng cho job đang xem (hỏi chi tiết nhiều lượt về cùng 1 job)
+    GEMINI_JOB_CONTEXT_CACHE_SIZE: int = int(
+        os.getenv("GEMINI_JOB_CONTEXT_CACHE_SIZE", "32")
+    )
+    GEMINI_JOB_CONTEXT_CACHE_TTL_SECONDS: int = int(
+        os.getenv("GEMINI_JOB_CONTEXT_CACHE_TTL_SECONDS", "600")
+    )
+    # cache câu trả lời Gemini (0 = tắt)
+    LLM_ANSWER_CACHE_SIZE: int = int(os.getenv("LLM_ANSWER_CACHE_SIZE", "1024"))
+    LLM_ANSWER_CACHE_TTL_SECONDS: int = int(
+        os.getenv("LLM_ANSWER_CACHE_TTL_SECONDS", "3600")
+    )
+    # file SQLite lưu cache câu trả lời qua các lần restart (rỗng = chỉ cache trong RAM)
+    LLM_ANSWER_CACHE_DB_PATH: str = os.getenv("LLM_ANSWER_CACHE_DB_PATH", "")
+    # semantic cache cho câu hỏi gần nghĩa (0 = tắt)
+    SEMANTIC_CACHE_SIZE: int = int(os.getenv("SEMANTIC_CACHE_SIZE", "10000"))
+    SEMANTIC_CACHE_THRESHOLD: float = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+    # cache nguyên kết quả chat theo (câu hỏi, job đang xem, vài lượt history cuối) (0 = tắt)
+    CHAT_RESPONSE_CACHE_SIZE: int = int(os.getenv("CHAT_RESPONSE_CACHE_SIZE", "2048"))
+    CHAT_RESPONSE_CACHE_TTL_SECONDS: int = int(
+        os.getenv("CHAT_RESPONSE_CACHE_TTL_SECONDS", "600")
+    )
 
 settings = Settings()
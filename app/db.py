@@ -1,20 +1,140 @@
 # app/db.py
 
-import psycopg2
+import threading
+from typing import Optional
+from uuid import uuid4
+
 from psycopg2.extras import RealDictCursor
+from psycopg2.pool import PoolError, ThreadedConnectionPool
 from .config import settings
 
+_pool: Optional[ThreadedConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+# Câu lệnh nóng, PREPARE 1 lần cho mỗi connection trong pool.
+# Gọi bằng: cur.execute("EXECUTE get_user(%s)", (user_id,))
+PREPARED_STATEMENTS = {
+    "get_user": """
+        PREPARE get_user (bigint) AS
+        SELECT id, full_name, email, phone, is_active
+        FROM users
+        WHERE id = $1
+    """,
+    "get_user_by_email": """
+        PREPARE get_user_by_email (text) AS
+        SELECT id, full_name, email, phone, password_hash, is_active
+        FROM users
+        WHERE email = $1
+    """,
+    "toggle_bookmark": """
+        PREPARE toggle_bookmark (bigint, bigint) AS
+        WITH del AS (
+            DELETE FROM user_job_bookmarks
+            WHERE user_id = $1 AND job_id = $2
+            RETURNING job_id
+        ),
+        ins AS (
+            INSERT INTO user_job_bookmarks (user_id, job_id)
+            SELECT $1, $2
+            WHERE NOT EXISTS (SELECT 1 FROM del)
+            ON CONFLICT (user_id, job_id) DO NOTHING
+            RETURNING job_id
+        )
+        SELECT (SELECT COUNT(*) FROM ins) AS inserted
+    """,
+}
+
+
+class _PreparingPool(ThreadedConnectionPool):
+    """
+    Pool chạy PREPARE cho PREPARED_STATEMENTS ngay khi mở connection mới.
+    Hết connection thì getconn() chờ có connection được trả lại (tối đa
+    POSTGRES_POOL_TIMEOUT_SECONDS) thay vì ném PoolError ngay như ThreadedConnectionPool.
+    """
+
+    def __init__(self, minconn, maxconn, *args, **kwargs):
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        self._slots = threading.BoundedSemaphore(maxconn)
+
+    def getconn(self, key=None):
+        if not self._slots.acquire(timeout=settings.POSTGRES_POOL_TIMEOUT_SECONDS):
+            raise PoolError("connection pool exhausted")
+        try:
+            return super().getconn(key)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn=None, key=None, close=False):
+        try:
+            super().putconn(conn, key, close)
+        finally:
+            self._slots.release()
+
+    def _connect(self, key=None):
+        conn = super()._connect(key)
+        with conn.cursor() as cur:
+            for sql in PREPARED_STATEMENTS.values():
+                cur.execute(sql)
+        conn.commit()
+        return conn
+
+
+def _get_pool() -> ThreadedConnectionPool:
+    """Khởi tạo pool lần đầu dùng (lazy), không mở kết nối lúc import."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = _PreparingPool(
+                    settings.POSTGRES_POOL_MIN,
+                    settings.POSTGRES_POOL_MAX,
+                    host=settings.POSTGRES_HOST,
+                    port=settings.POSTGRES_PORT,
+                    dbname=settings.POSTGRES_DB,
+                    user=settings.POSTGRES_USER,
+                    password=settings.POSTGRES_PASSWORD,
+                    # gắn 1 lần cho mọi cursor của connection
+                    cursor_factory=RealDictCursor,
+                )
+    return _pool
+
+
+class PooledConnection:
+    """
+    Connection mượn từ pool, dùng y như psycopg2 connection.
+    - `with conn:` commit/rollback như cũ, sau đó trả connection về pool.
+    - `conn.close()` cũng trả về pool thay vì đóng hẳn.
+    """
+
+    def __init__(self, pool: ThreadedConnectionPool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            return self._conn.__exit__(exc_type, exc, tb)
+        finally:
+            self.close()
+
+    def close(self):
+        if self._conn is not None:
+            # putconn tự rollback nếu connection còn dở transaction
+            self._pool.putconn(self._conn)
+            self._conn = None
+
 
 def get_connection():
-    conn = psycopg2.connect(
-        host=settings.POSTGRES_HOST,
-        port=settings.POSTGRES_PORT,
-        dbname=settings.POSTGRES_DB,
-        user=settings.POSTGRES_USER,
-        password=settings.POSTGRES_PASSWORD,
-        cursor_factory=RealDictCursor,
-    )
-    return conn
+    pool = _get_pool()
+    return PooledConnection(pool, pool.getconn())
 
 def upsert_company(cur, company_row: dict) -> int:
     """
@@ -137,5 +257,18 @@ def upsert_job(cur, job_row: dict) -> int:
 def get_cursor(conn):
     """
     Trả về cursor kiểu RealDictCursor (row là dict thay vì tuple).
+    cursor_factory đã gắn sẵn trên connection của pool.
+    """
+    return conn.cursor()
+
+
+def named_cursor(conn, prefix: str, itersize: Optional[int] = None):
+    """
+    Server-side cursor (tên duy nhất theo prefix) để stream row
+    thay vì fetchall() toàn bộ kết quả vào bộ nhớ client.
+    Chỉ dùng được bên trong transaction và chỉ execute 1 lần.
     """
-    return conn.cursor(cursor_factory=RealDictCursor)
+    cur = conn.cursor(name=f"{prefix}_{uuid4().hex}")
+    if itersize:
+        cur.itersize = itersize
+    return cur
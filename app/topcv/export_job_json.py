@@ -17,6 +17,7 @@ def get_connection():
         dbname=settings.POSTGRES_DB,
         user=settings.POSTGRES_USER,
         password=settings.POSTGRES_PASSWORD,
+        cursor_factory=RealDictCursor,
     )
     return conn
 
@@ -26,7 +27,7 @@ def fetch_job_row(
     job_id: Optional[int] = None,
     url: Optional[str] = None,
 ) -> Optional[Dict[str, Any]]:
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+    with conn.cursor() as cur:
         base_select = """
             SELECT
                 j.*,
@@ -64,12 +65,12 @@ def fetch_locations(conn, job_id: int) -> List[str]:
             """,
             (job_id,),
         )
-        return [r[0] for r in cur.fetchall()]
+        return [r["location_text"] for r in cur.fetchall()]
 
 # lấy sections
 def fetch_sections(conn, job_id: int) -> Dict[str, Dict[str, Optional[str]]]:
     sections: Dict[str, Dict[str, Optional[str]]] = {}
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+    with conn.cursor() as cur:
         cur.execute(
             """
             SELECT section_type, text_content, html_content, id
@@ -1,6 +1,5 @@
 import json
 from typing import List
-from psycopg2.extras import RealDictCursor
 from app.topcv.export_job_json import (
     get_connection,
     fetch_job_row,
@@ -10,7 +9,7 @@ from app.topcv.export_job_json import (
 )
 
 def fetch_active_indexed_job_ids(conn, limit: int = 2000) -> List[int]:
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+    with conn.cursor() as cur:
         cur.execute(
             """
             SELECT j.id
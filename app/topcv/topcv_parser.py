@@ -60,6 +60,8 @@ HEADERS = {
     )
 }
 
+_WS_RE = re.compile(r"\s+")
+
 
 # ----------------- HỖ TRỢ CƠ BẢN -----------------
 
@@ -225,7 +227,7 @@ def _cleanup_thu_nhap_section(section: Dict[str, Optional[str]], company_name: O
         return section
 
     def _norm(s: str) -> str:
-        return re.sub(r"\s+", " ", s or "").strip().casefold()
+        return _WS_RE.sub(" ", s or "").strip().casefold()
 
     text_norm = _norm(section.get("text") or "")
     company_norm = _norm(company_name)
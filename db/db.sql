@@ -46,6 +46,9 @@ CREATE UNIQUE INDEX IF NOT EXISTS ux_jobs_url ON jobs(url);
 CREATE INDEX IF NOT EXISTS idx_jobs_company_id ON jobs(company_id);
 CREATE INDEX IF NOT EXISTS idx_jobs_deadline ON jobs(deadline);
 CREATE INDEX IF NOT EXISTS idx_jobs_crawled_at ON jobs(crawled_at);
+-- thứ tự listing (bookmark + trong từng nhóm hạn nộp ở trang chủ)
+CREATE INDEX IF NOT EXISTS idx_jobs_crawled_at_id
+    ON jobs (crawled_at DESC NULLS LAST, id DESC);
 
 
 -- table job_locations
@@ -60,6 +63,9 @@ CREATE TABLE IF NOT EXISTS job_locations (
 );
 
 CREATE INDEX IF NOT EXISTS idx_job_locations_job_id ON job_locations(job_id);
+-- lấy địa điểm chính của job (LATERAL ... ORDER BY ... LIMIT 1)
+CREATE INDEX IF NOT EXISTS idx_job_locations_job_primary
+    ON job_locations (job_id, is_primary DESC, sort_order, id);
 
 
 -- table job_sections
@@ -156,6 +162,7 @@ CREATE TABLE IF NOT EXISTS user_job_bookmarks (
     PRIMARY KEY (user_id, job_id)
 );
 
+-- PRIMARY KEY (user_id, job_id) đã phủ truy vấn theo user_id (index-only scan)
 CREATE INDEX IF NOT EXISTS idx_user_job_bookmarks_user_id
     ON user_job_bookmarks (user_id);
 
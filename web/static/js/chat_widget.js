@@ -2,6 +2,13 @@
 
 (function () {
   const CHAT_STORAGE_KEY = "jf_chat_history_v1";
+  // chỉ gửi vài tin nhắn cuối (server cũng cắt theo RAG_MAX_HISTORY_TURNS)
+  const MAX_HISTORY_SEND = 10;
+  // chia đoạn stream lớn (> SMOOTH_MIN_CHUNK ký tự) ra hiện dần cho mượt
+  const SMOOTH_STREAM = true;
+  const SMOOTH_MIN_CHUNK = 50;
+  const SMOOTH_STEP_CHARS = 4;
+  const SMOOTH_INTERVAL_MS = 20;
 
   let chatOpen = false;
   let chatHistory = [];
@@ -123,6 +130,117 @@
     }
   }
 
+  // bubble tạm cho câu trả lời đang stream (chưa lưu vào history)
+  function appendStreamingBubble() {
+    const item = document.createElement("div");
+    item.className = "chat-msg mb-2 flex justify-start";
+    const bubble = document.createElement("div");
+    bubble.className =
+      "inline-block px-3 py-2 rounded-2xl text-sm max-w-[80%] bg-white border border-gray-200 text-gray-800 whitespace-pre-line";
+    item.appendChild(bubble);
+    messagesEl.appendChild(item);
+    scrollToBottom();
+    return bubble;
+  }
+
+  /**
+   * Hiện text stream dần dần: đoạn nhỏ hiện ngay, đoạn lớn được cắt SMOOTH_STEP_CHARS
+   * ký tự mỗi SMOOTH_INTERVAL_MS. Tồn đọng nhiều thì mỗi bước lấy nhiều hơn để
+   * không bị trễ quá ~10 bước so với server.
+   */
+  function createSmoothWriter(onText) {
+    let pending = "";
+    let timer = null;
+
+    function tick() {
+      if (!pending) {
+        clearInterval(timer);
+        timer = null;
+        return;
+      }
+      const step = Math.max(SMOOTH_STEP_CHARS, Math.ceil(pending.length / 10));
+      onText(pending.slice(0, step));
+      pending = pending.slice(step);
+    }
+
+    return {
+      push(piece) {
+        if (!SMOOTH_STREAM || (!pending && piece.length <= SMOOTH_MIN_CHUNK)) {
+          onText(piece);
+          return;
+        }
+        pending += piece;
+        if (!timer) timer = setInterval(tick, SMOOTH_INTERVAL_MS);
+      },
+      stop() {
+        if (timer) clearInterval(timer);
+        timer = null;
+        pending = "";
+      },
+    };
+  }
+
+  /**
+   * Gọi /api/chat/stream (SSE qua fetch), gọi onDelta(text, lines) với từng đoạn text thô
+   * và HTML của các dòng vừa hoàn chỉnh (mỗi dòng thô 1 phần tử, có thể rỗng).
+   * Trả về payload của event "done" (giống JSON của /api/chat).
+   * Trình duyệt không hỗ trợ stream body -> fallback /api/chat.
+   */
+  async function sendChat(payload, onDelta) {
+    const headers = { "Content-Type": "application/json" };
+    const body = JSON.stringify(payload);
+
+    if (typeof ReadableStream === "undefined" || typeof TextDecoder === "undefined") {
+      const fallback = await fetch("/api/chat", { method: "POST", headers, body });
+      if (!fallback.ok) {
+        throw new Error("HTTP " + fallback.status);
+      }
+      return fallback.json();
+    }
+
+    const res = await fetch("/api/chat/stream", { method: "POST", headers, body });
+    if (!res.ok || !res.body) {
+      throw new Error("HTTP " + res.status);
+    }
+
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder("utf-8");
+    let buffer = "";
+    let done = null;
+
+    while (true) {
+      const { value, done: finished } = await reader.read();
+      if (finished) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      let sep;
+      while ((sep = buffer.indexOf("\n\n")) !== -1) {
+        const rawEvent = buffer.slice(0, sep);
+        buffer = buffer.slice(sep + 2);
+
+        let eventName = "message";
+        let dataText = "";
+        rawEvent.split("\n").forEach((line) => {
+          if (line.startsWith("event:")) eventName = line.slice(6).trim();
+          else if (line.startsWith("data:")) dataText += line.slice(5).trim();
+        });
+        if (!dataText) continue;
+
+        const data = JSON.parse(dataText);
+        if (eventName === "delta") {
+          onDelta(data.text || "", data.lines || []);
+        } else if (eventName === "done") {
+          done = data;
+        }
+      }
+    }
+
+    if (!done) {
+      throw new Error("Stream kết thúc mà không có câu trả lời");
+    }
+    return done;
+  }
+
   function openChat() {
     chatOpen = true;
     panel.classList.remove("hidden");
@@ -171,7 +289,7 @@
     const text = (input.value || "").trim();
     if (!text) return;
 
-    const historyToSend = chatHistory.slice();
+    const historyToSend = chatHistory.slice(-MAX_HISTORY_SEND);
 
     chatHistory.push({ role: "user", content: text });
     renderHistory();
@@ -185,23 +303,51 @@
         ? window.JF_CURRENT_JOB_ID
         : null;
 
-    fetch("/api/chat", {
-      method: "POST",
-      headers: {
-        "Content-Type": "application/json",
-      },
-      body: JSON.stringify({
+    let linesEl = null;
+    let tailEl = null;
+    let partial = "";
+    let shownLines = 0;
+    let flushedLines = 0;
+    let flushedPos = 0;
+    const htmlLines = [];
+    // các dòng đã hiện hết -> HTML server gửi kèm (link bấm được), chỉ nối thêm dòng mới
+    // vào linesEl thay vì dựng lại cả bubble mỗi bước; dòng đang hiện dở -> text thô ở
+    // tailEl. HTML hoàn chỉnh thay vào khi "done"
+    const writer = createSmoothWriter((piece) => {
+      if (!linesEl) {
+        const bubble = appendStreamingBubble();
+        linesEl = document.createElement("span");
+        tailEl = document.createElement("span");
+        bubble.appendChild(linesEl);
+        bubble.appendChild(tailEl);
+      }
+      partial += piece;
+      shownLines += (piece.match(/\n/g) || []).length;
+      const target = Math.min(shownLines, htmlLines.length);
+      if (target > flushedLines) {
+        linesEl.insertAdjacentHTML(
+          "beforeend",
+          htmlLines.slice(flushedLines, target).join("")
+        );
+        for (; flushedLines < target; flushedLines++) {
+          flushedPos = partial.indexOf("\n", flushedPos) + 1;
+        }
+      }
+      tailEl.textContent = partial.slice(flushedPos);
+      scrollToBottom();
+    });
+
+    sendChat(
+      {
         message: text,
         history: historyToSend,
         current_job_id: currentJobId,
-      }),
-    })
-      .then(async (res) => {
-        if (!res.ok) {
-          throw new Error("HTTP " + res.status);
-        }
-        return res.json();
-      })
+      },
+      (piece, lines) => {
+        htmlLines.push(...lines);
+        writer.push(piece);
+      }
+    )
       .then((data) => {
         const answer = data.answer || "(Không có câu trả lời)";
         const newHistory = Array.isArray(data.history) ? data.history : null;
@@ -227,6 +373,7 @@
         saveHistoryToStorage();
       })
       .finally(() => {
+        writer.stop();
         setSendingState(false);
         input.focus();
       });